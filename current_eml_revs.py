@@ -21,6 +21,8 @@ import os
 import requests
 import sys
 
+from eml_shards import ShardReader, ShardWriter, drop_pids
+
 logging.basicConfig(format='%(asctime)s %(levelname)s (%(name)s): %(message)s', 
                     datefmt='%Y-%m-%d %H:%M:%S%z',
                     # filename='current_eml_revs' + '.log',
@@ -128,17 +130,48 @@ def file_to_do(output_dir: str,
     return not this_rev_exists
 
 
+def shard_to_do(archived: dict,
+                superseded: set,
+                fp,
+                scope: str,
+                identifier: str,
+                revision: str) -> bool:
+    # Other archived revisions are recorded in superseded, to be dropped
+    # from the shard index. If this revision is archived, return False,
+    # otherwise True.
+    this_rev_exists = False
+    for pid in sorted(archived.get(f'{scope}.{identifier}', ())):
+        if pid.rsplit('.', 1)[1] == revision:
+            this_rev_exists = True
+        else:
+            print(f'Removing {pid}', file=fp)
+            superseded.add(pid)
+    return not this_rev_exists
+
+
 def get_current_eml_revs(base_url=None, 
                          output_dir=None,
                          fp=None,
                          scopes=None, 
-                         black_list=None):
+                         black_list=None,
+                         shards=False):
     """
-    Gets EML for newest revisions of data packages
+    Gets EML for newest revisions of data packages. If shards is True,
+    EML is appended to zip archive shards in output_dir rather than
+    written one file per package, and superseded revisions are dropped
+    from the shard index (their bytes remain in the shards).
     """
 
     unparsed = []
 
+    shard_writer = None
+    if shards:
+        archived = dict()
+        for pid in ShardReader(output_dir).pids():
+            archived.setdefault(pid.rsplit('.', 1)[0], set()).add(pid)
+        superseded = set()
+        shard_writer = ShardWriter(output_dir)
+
     for scope in scopes:
         if scope not in black_list:
             identifiers = get_identifiers(base_url=base_url, scope=scope)
@@ -148,11 +181,19 @@ def get_current_eml_revs(base_url=None,
                                                identifier=identifier)
                 # print(scope, identifier, revision)
                 package_id = scope + '.' + identifier + '.' + revision
-                if not file_to_do(output_dir=output_dir, 
-                                  fp=fp, 
-                                  scope=scope, 
-                                  identifier=identifier, 
-                                  revision=revision):
+                if shard_writer is not None:
+                    if not shard_to_do(archived=archived,
+                                       superseded=superseded,
+                                       fp=fp,
+                                       scope=scope,
+                                       identifier=identifier,
+                                       revision=revision):
+                        continue
+                elif not file_to_do(output_dir=output_dir, 
+                                    fp=fp, 
+                                    scope=scope, 
+                                    identifier=identifier, 
+                                    revision=revision):
                     continue
                 path = package_id_to_path(package_id)
                 metadata_url = base_url + '/package/metadata/eml/' + path
@@ -161,15 +202,22 @@ def get_current_eml_revs(base_url=None,
                     if r.status_code == requests.codes.ok:
                         eml = r.text
                         print(package_id, file=fp)
-                        output_filepath = f'{output_dir}/{package_id}.eml'
-                        with open(output_filepath, 'w') as output_file:
-                            output_file.write(eml)
+                        if shard_writer is not None:
+                            shard_writer.write(package_id, eml)
+                        else:
+                            output_filepath = f'{output_dir}/{package_id}.eml'
+                            with open(output_filepath, 'w') as output_file:
+                                output_file.write(eml)
                     else:
                         rdict = get_resource_dict(package_id, metadata_url, "", "")
                         unparsed.append(rdict)
                 except Exception as e:
                     logger.error(e)
 
+    if shard_writer is not None:
+        shard_writer.close()
+        drop_pids(output_dir, superseded)
+
     scanned_resources = {}
     scanned_resources["unparsed"] = unparsed
     json.dump(scanned_resources, fp, indent=2, separators=(',', ': '))
@@ -185,6 +233,7 @@ def main():
                             [-s | --scope <scope>]  
                             [-d | --dir <dir>]
                             [-o | --output <output>]
+                            [-z | --shards]
         current_eml_revs.py -h | --help
 
     Options:
@@ -195,6 +244,11 @@ def main():
         -d --dir        Save the results to files in given dir.
                         Directory is assumed to exist; default= "eml" 
         -o --output     Print destination; default=stdout
+        -z --shards     Save the EML to zip archive shards with a
+                        package ID index in dir, instead of one
+                        file per package; superseded revisions
+                        are dropped from the index but remain in
+                        the shards
         -h --help       This page
 
     """
@@ -207,6 +261,7 @@ def main():
     scope = args['<scope>']
     output_dir = args['<dir>']
     output = args['<output>']
+    shards = args['--shards']
 
     if not url:
         BASE_URL = "https://pasta.lternet.edu"
@@ -230,7 +285,8 @@ def main():
                          output_dir=output_dir,
                          fp=fp,
                          scopes=scopes, 
-                         black_list=black_list)
+                         black_list=black_list,
+                         shards=shards)
 
     logger.info("Finished program")
 
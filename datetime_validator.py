@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: datetime_validator
+
+:Synopsis:
+    Validate that every value of the datetime columns of a data table
+    matches the column's declared EML formatString. The regular expression
+    of each format string is compiled once and the table is streamed in
+    batches of rows, so memory does not depend on the size of the table.
+    usage: datetime_validator.py -f date=YYYY-MM-DD -f 3=hh:mm table.csv
+           datetime_validator.py -e knb-lter-abc.1.1.xml -n "Daily table" table.csv
+
+    By default each batch of a column is matched as a whole: the values are
+    joined with newlines and the (^...$ anchored) regular expression is run
+    over the joined text in multiline mode, counting the matches of the
+    batch in one call without a match object per value. Values are only
+    matched one at a time in a batch that has failures, to record the first
+    failures of the column.
+
+:Created:
+    10/18/26
+"""
+import csv
+import json
+from pathlib import Path
+import re
+import sys
+
+import click
+import daiquiri
+from lxml import etree
+
+from format_string_parser import format_string_visitor
+
+
+logger = daiquiri.getLogger(__name__)
+
+BATCH_SIZE = 10000
+FAILURES = 10
+
+
+class ColumnValidator:
+    """ColumnValidator
+    Match counts and the first failures of the values of one column against
+    the regular expression of its format string. Empty values are counted
+    as missing rather than as failures.
+    """
+
+    def __init__(self, index: int, name: str, format_string: str, failures: int = FAILURES):
+        self.index = index
+        self.name = name
+        self.format_string = format_string
+        self.regex = format_string_visitor(format_string)
+        self.pattern = re.compile(self.regex, re.M)
+        self.max_failures = failures
+        self.matched = 0
+        self.failed = 0
+        self.missing = 0
+        self.failures = []
+
+    def validate(self, values: tuple, first: int):
+        """validate
+        Matches values one at a time, first being the record number of the
+        first value.
+        """
+        for i, value in enumerate(values):
+            if value == "":
+                self.missing += 1
+            elif self.pattern.fullmatch(value):
+                self.matched += 1
+            else:
+                self.failed += 1
+                if len(self.failures) < self.max_failures:
+                    self.failures.append((first + i, value))
+
+    def validate_batch(self, values: tuple, first: int):
+        """validate_batch
+        Matches values as one newline-joined text, falling back to validate()
+        for a batch with a value containing a newline or with failures still
+        to be recorded.
+        """
+        text = "\n".join(values)
+        if text.count("\n") != len(values) - 1:
+            self.validate(values, first)
+            return
+        missing = values.count("")
+        matched = self.pattern.subn("", text)[1]
+        failed = len(values) - missing - matched
+        if failed > 0 and len(self.failures) < self.max_failures:
+            self.validate(values, first)
+            return
+        self.missing += missing
+        self.matched += matched
+        self.failed += failed
+
+    def report(self) -> dict:
+        return {
+            "column": self.name,
+            "index": self.index + 1,
+            "format_string": self.format_string,
+            "regex": self.regex,
+            "matched": self.matched,
+            "failed": self.failed,
+            "missing": self.missing,
+            "failures": self.failures,
+        }
+
+
+def eml_formats(eml: str, entity: str = None) -> tuple:
+    """eml_formats
+    Returns the [(column index, attribute name, formatString), ...] of the
+    dateTime attributes of the data table named entity (the first data table
+    if None) of an EML file, its number of header lines and its field
+    delimiter (None where the EML does not say).
+    """
+    root = etree.parse(eml).getroot()
+    for table in root.iterfind(".//dataset/dataTable"):
+        name = (table.findtext("./entityName") or "").strip()
+        if entity is None or name == entity:
+            break
+    else:
+        msg = f"Data table '{entity}' not found in '{eml}'"
+        raise ValueError(msg)
+
+    formats = []
+    for index, attribute in enumerate(table.iterfind("./attributeList/attribute")):
+        format_string = attribute.findtext("./measurementScale/dateTime/formatString")
+        if format_string is not None and format_string.strip() != "":
+            name = (attribute.findtext("./attributeName") or str(index + 1)).strip()
+            formats.append((index, name, format_string.strip()))
+
+    header_lines = table.findtext("./physical/dataFormat/textFormat/numHeaderLines")
+    header_lines = None if header_lines is None else int(header_lines)
+    delimiter = table.findtext(".//physical/dataFormat/textFormat/simpleDelimited/fieldDelimiter")
+    if delimiter is not None:
+        delimiter = {"\\t": "\t", "tab": "\t", "comma": ","}.get(delimiter.strip().lower(), delimiter)
+    return formats, header_lines, delimiter
+
+
+def validate_table(
+        table,
+        validators: list,
+        delimiter: str = ",",
+        header_lines: int = 1,
+        batch_size: int = BATCH_SIZE,
+        batch: bool = True
+) -> int:
+    """validate_table
+    Streams the records of the open CSV file table into validators and
+    returns the number of data records. Records shorter than the header (or
+    than the widest validated column) are padded with missing values.
+    """
+    reader = csv.reader(table, delimiter=delimiter)
+    for _ in range(header_lines):
+        next(reader, None)
+    width = max(_.index for _ in validators) + 1
+    first = header_lines + 1
+    records = 0
+    while True:
+        rows = []
+        for row in reader:
+            if len(row) < width:
+                row = row + [""] * (width - len(row))
+            rows.append(row)
+            if len(rows) == batch_size:
+                break
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        for validator in validators:
+            if batch:
+                validator.validate_batch(columns[validator.index], first)
+            else:
+                validator.validate(columns[validator.index], first)
+        first += len(rows)
+        records += len(rows)
+    return records
+
+
+def read_header(table: str, delimiter: str, header_lines: int) -> list:
+    if header_lines == 0:
+        return []
+    with open(table, "r", newline="", encoding="utf-8") as f:
+        return next(csv.reader(f, delimiter=delimiter), [])
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument("table")
+@click.option("-f", "--format", "formats", multiple=True,
+              help="COLUMN=FORMAT where COLUMN is a header name or 1-based index e.g. -f date=YYYY-MM-DD")
+@click.option("-e", "--eml", default=None, help="Take the dateTime formatStrings of the table from this EML file")
+@click.option("-n", "--entity", default=None, help="Entity name of the table in the EML (default first dataTable)")
+@click.option("-d", "--delimiter", default=None, help="Field delimiter (default from EML, else ',')")
+@click.option("--header_lines", default=None, type=int, help="Number of header lines (default from EML, else 1)")
+@click.option("-F", "--failures", default=FAILURES, help=f"Failures to report per column (default {FAILURES})")
+@click.option("-b", "--batch_size", default=BATCH_SIZE, help=f"Records matched per batch (default {BATCH_SIZE})")
+@click.option("--per_value", is_flag=True, help="Match values one at a time instead of as a batch")
+@click.option("-o", "--output", default=None, help="JSON report file (defaults to stdout)")
+def main(
+        table: str,
+        formats: tuple,
+        eml: str,
+        entity: str,
+        delimiter: str,
+        header_lines: int,
+        failures: int,
+        batch_size: int,
+        per_value: bool,
+        output: str
+):
+    """
+        Validate the datetime columns of the CSV data TABLE against their
+        declared EML format strings and report match counts and the first
+        failures of each column as JSON.
+    """
+    if not Path(table).is_file():
+        msg = f'Table "{table}" does not exist'
+        raise click.ClickException(msg)
+    if batch_size < 1:
+        msg = "Batch size must be a positive number of records"
+        raise click.ClickException(msg)
+
+    columns = []
+    if eml is not None:
+        try:
+            columns, eml_header_lines, eml_delimiter = eml_formats(eml, entity)
+        except (OSError, ValueError, etree.XMLSyntaxError) as e:
+            raise click.ClickException(str(e))
+        header_lines = eml_header_lines if header_lines is None else header_lines
+        delimiter = eml_delimiter if delimiter is None else delimiter
+    delimiter = "," if delimiter is None else delimiter
+    header_lines = 1 if header_lines is None else header_lines
+
+    header = read_header(table, delimiter, header_lines)
+    for f in formats:
+        column, _, format_string = f.partition("=")
+        if column.isdigit():
+            index = int(column) - 1
+            name = header[index] if index < len(header) else column
+        elif column in header:
+            index, name = header.index(column), column
+        else:
+            msg = f"Column '{column}' not found in the header of '{table}'"
+            raise click.ClickException(msg)
+        columns.append((index, name, format_string))
+    if len(columns) == 0:
+        msg = "No datetime columns to validate; use -f or -e"
+        raise click.ClickException(msg)
+
+    validators = []
+    for index, name, format_string in columns:
+        try:
+            validators.append(ColumnValidator(index, name, format_string, failures))
+        except Exception as e:
+            logger.error(f"Column '{name}' has an invalid format string '{format_string}': {e}")
+    if len(validators) == 0:
+        msg = "None of the datetime columns has a valid format string"
+        raise click.ClickException(msg)
+
+    with open(table, "r", newline="", encoding="utf-8") as f:
+        records = validate_table(f, validators, delimiter, header_lines, batch_size, not per_value)
+
+    for v in validators:
+        if v.failed > 0:
+            logger.warning(f"Column '{v.name}': {v.failed} of {records} values do not match '{v.format_string}'")
+
+    report = {"table": table, "records": records, "columns": [_.report() for _ in validators]}
+    r = sys.stdout if output is None else open(output, "w")
+    try:
+        json.dump(report, r, indent=2)
+        r.write("\n")
+    finally:
+        if output is not None:
+            r.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: eml_extract
+
+:Synopsis:
+    Single-pass extraction of facts from EML documents. Extractors register
+    the element names whose subtrees they need; one streaming parse of each
+    document dispatches every such subtree to the extractors registered for
+    it and produces one combined record per document.
+    usage: eml_extract.py -x funding -x dois /tmp/eml > /tmp/eml.jsonl
+
+:Created:
+    10/18/26
+"""
+from collections import defaultdict
+import hashlib
+import json
+from multiprocessing import Pool
+from pathlib import Path
+import sys
+
+import click
+import daiquiri
+from lxml import etree
+
+from project import flatten
+
+
+logger = daiquiri.getLogger(__name__)
+
+ENTITY_TYPES = ("dataTable", "spatialRaster", "spatialVector", "otherEntity")
+
+
+def localname(element) -> str:
+    return element.tag.rpartition("}")[2]
+
+
+def parent_name(element) -> str:
+    parent = element.getparent()
+    return None if parent is None else localname(parent)
+
+
+def is_dataset_entity(element) -> bool:
+    """is_dataset_entity
+    True for the data entities of the dataset itself, as opposed to those
+    nested elsewhere, such as in a methods dataSource.
+    """
+    return localname(element) in ENTITY_TYPES and parent_name(element) == "dataset"
+
+
+def entity_name(entity) -> str:
+    name = entity.findtext("./entityName")
+    return None if name is None else name.strip()
+
+
+class Extractor:
+    """Extractor
+    Base class of extractors. name is the key of the extractor's value in
+    the combined record and tags are the local names of the elements whose
+    subtrees are passed to handle() once each has been parsed. The subtree
+    and its ancestors are complete at that point; elements outside of the
+    enclosing top level dataset section may already have been discarded.
+    """
+    name = None
+    tags = ()
+
+    def begin(self, record: dict):
+        record[self.name] = []
+
+    def handle(self, element, record: dict):
+        raise NotImplementedError
+
+
+class TitleExtractor(Extractor):
+    name = "title"
+    tags = ("title",)
+
+    def begin(self, record: dict):
+        record[self.name] = None
+
+    def handle(self, element, record: dict):
+        if record[self.name] is None and parent_name(element) == "dataset":
+            record[self.name] = flatten(element)
+
+
+class FundingExtractor(Extractor):
+    name = "funding"
+    tags = ("funding",)
+
+    def begin(self, record: dict):
+        record[self.name] = None
+
+    def handle(self, element, record: dict):
+        if record[self.name] is None and parent_name(element) == "project":
+            record[self.name] = flatten(element)
+
+
+class EntityExtractor(Extractor):
+    """Entities as (entity type, entity name, PASTA MD5 of the name)"""
+    name = "entities"
+    tags = ENTITY_TYPES
+
+    def handle(self, element, record: dict):
+        if is_dataset_entity(element):
+            name = entity_name(element)
+            md5 = None if name is None else hashlib.md5(name.encode()).hexdigest()
+            record[self.name].append((localname(element), name, md5))
+
+
+class DistributionExtractor(Extractor):
+    """Distributions of dataset entities as (entity name, object name, online url, offline medium name)"""
+    name = "distributions"
+    tags = ("physical",)
+
+    def handle(self, element, record: dict):
+        entity = element.getparent()
+        if entity is None or not is_dataset_entity(entity):
+            return
+        name = entity_name(entity)
+        object_name = element.findtext("./objectName")
+        for distribution in element.iterfind("./distribution"):
+            url = distribution.findtext("./online/url")
+            medium_name = distribution.findtext("./offline/mediumName")
+            record[self.name].append((name, object_name, url, medium_name))
+
+
+class UnitExtractor(Extractor):
+    """Units of dataset entity attributes as (entity name, attribute name, unit, standardUnit or customUnit)"""
+    name = "units"
+    tags = ("attribute",)
+
+    def handle(self, element, record: dict):
+        for ancestor in element.iterancestors():
+            if localname(ancestor) in ENTITY_TYPES:
+                break
+        else:
+            return
+        if not is_dataset_entity(ancestor):
+            return
+        name = entity_name(ancestor)
+        attribute_name = element.findtext("./attributeName")
+        for unit_type in ("standardUnit", "customUnit"):
+            for unit in element.iterfind(f".//{unit_type}"):
+                record[self.name].append((name, attribute_name, unit.text, unit_type))
+
+
+class UnitDefinitionExtractor(Extractor):
+    """Ids of the custom units defined in unitLists of the document"""
+    name = "unit_definitions"
+    tags = ("unit",)
+
+    def handle(self, element, record: dict):
+        if parent_name(element) == "unitList" and element.get("id") is not None:
+            record[self.name].append(element.get("id"))
+
+
+class DOIExtractor(Extractor):
+    name = "dois"
+    tags = ("alternateIdentifier",)
+
+    def handle(self, element, record: dict):
+        text = (element.text or "").strip()
+        if text.startswith("doi:"):
+            record[self.name].append(text)
+        elif "doi.org/" in text:
+            record[self.name].append("doi:" + text.split("doi.org/", 1)[1])
+
+
+EXTRACTORS = dict()
+
+
+def register(extractor: Extractor):
+    EXTRACTORS[extractor.name] = extractor
+
+
+for _ in (
+        TitleExtractor, FundingExtractor, EntityExtractor, DistributionExtractor, UnitExtractor,
+        UnitDefinitionExtractor, DOIExtractor
+):
+    register(_())
+
+
+def extract(source, extractors: list) -> dict:
+    """extract
+    Parses source (a file name or file object) once and returns the combined
+    record of the package id and the value of every extractor.
+
+    Elements are dispatched on their end event. Children of the root and of
+    dataset are discarded once they, and any extractors registered for them
+    or their descendants, are done, so memory is bounded by the largest
+    top level section rather than by the document.
+    """
+    handlers = defaultdict(list)
+    record = {"package_id": None}
+    for extractor in extractors:
+        extractor.begin(record)
+        for tag in extractor.tags:
+            handlers[tag].append(extractor)
+
+    level = 0
+    for event, element in etree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if level == 0:
+                record["package_id"] = element.get("packageId")
+            level += 1
+            continue
+        level -= 1
+        for extractor in handlers.get(localname(element), ()):
+            extractor.handle(element, record)
+        if level <= 2:
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    return record
+
+
+def extract_file(args: tuple) -> tuple:
+    """extract_file
+    Returns (path, record, error) for an EML file and extractor names.
+    """
+    path, names = args
+    try:
+        return path, extract(path, [EXTRACTORS[_] for _ in names]), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def extract_files(paths: list, names: list, workers: int = 1, chunksize: int = 64):
+    """extract_files
+    Generates (path, record, error) for each of paths, in order, using a
+    process pool when workers > 1.
+    """
+    tasks = ((_, names) for _ in paths)
+    if workers > 1:
+        with Pool(workers) as pool:
+            yield from pool.imap(extract_file, tasks, chunksize)
+    else:
+        yield from map(extract_file, tasks)
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument("e_dir")
+@click.option("-x", "--extractor", "names", multiple=True, type=click.Choice(sorted(EXTRACTORS)),
+              help="Extractor(s) to run e.g. -x funding -x units (default all)")
+@click.option("-w", "--workers", default=1, help="Number of worker processes (default 1, no pool)")
+@click.option("-o", "--output", default=None, help="JSON lines output file (defaults to stdout)")
+def main(e_dir: str, names: tuple, workers: int, output: str):
+    """
+        Write one JSON record per EML file of E_DIR with the values of the
+        selected extractors, parsing each document once.
+    """
+    if not Path(e_dir).is_dir():
+        msg = f'Directory "{e_dir}" does not exist'
+        raise click.ClickException(msg)
+
+    names = list(names) if names else sorted(EXTRACTORS)
+    paths = sorted(str(_) for _ in Path(e_dir).iterdir() if _.suffix in (".xml", ".eml"))
+    f = sys.stdout if output is None else open(output, "w", encoding="utf-8")
+    try:
+        for path, record, error in extract_files(paths, names, workers):
+            if error is not None:
+                logger.error(f'Failed to parse "{path}": {error}')
+            else:
+                f.write(json.dumps(record) + "\n")
+    finally:
+        if output is not None:
+            f.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
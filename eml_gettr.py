@@ -17,6 +17,7 @@
     2/21/19
 """
 import asyncio
+import functools
 import logging
 from pathlib import Path
 import os
@@ -28,6 +29,9 @@ from lxml import etree
 import requests
 from sqlalchemy.testing.config import ident
 
+from eml_revision_store import RevisionStore
+from eml_shards import ShardReader, ShardWriter
+
 cwd = os.path.dirname(os.path.realpath(__file__))
 logfile = cwd + "/eml_gettr.log"
 daiquiri.setup(level=logging.INFO,
@@ -61,19 +65,43 @@ def get_pids_solr(env: str, count: int, include: tuple, exclude: tuple, verbose:
     return pids
 
 
-def get_pids_pasta(env: str, count: int, include: tuple, exclude: tuple, verbose: bool) -> list:
+async def get_text(session: aiohttp.ClientSession, url: str, semaphore: asyncio.Semaphore) -> str:
+    async with semaphore:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            return await resp.text()
+
+
+def split_lines(text: str) -> list:
+    return [_.strip() for _ in text.split("\n") if _.strip() != ""]
+
+
+async def get_pids_pasta(
+        session: aiohttp.ClientSession,
+        env: str,
+        count: int,
+        include: tuple,
+        exclude: tuple,
+        verbose: bool,
+        queue: asyncio.Queue,
+        list_size: int
+) -> int:
     """get_pids_pasta
-    Return all revisions of data packages for given scopes.
+    Stream all revisions of data packages for given scopes into queue.
+
+    Identifier and revision listings are requested concurrently, bounded by
+    list_size open requests; no more than count pids are placed on the queue,
+    and listing stops once count pids have been queued. Returns the number
+    of pids queued.
     """
 
     include = set(include)
     exclude = set(exclude)
+    semaphore = asyncio.Semaphore(list_size)
 
     # Get superset of scope values
     scope_url = f"{env}/eml"
-    req = requests.get(scope_url)
-    req.raise_for_status()
-    scopes = set(req.text.split("\n"))
+    scopes = set(split_lines(await get_text(session, scope_url, semaphore)))
 
     if len(include) != 0:
         scopes = (scopes & include) - exclude
@@ -81,56 +109,228 @@ def get_pids_pasta(env: str, count: int, include: tuple, exclude: tuple, verbose
         scopes = scopes - exclude
 
     c = 0
-    pids = []
-    for s in scopes:
-        identifier_url = f"{env}/eml/{s}"
-        req = requests.get(identifier_url)
-        req.raise_for_status()
-        identifiers = req.text.split("\n")
-        for i in identifiers:
-            revisions_url = f"{env}/eml/{include}/{i}"
-            req = requests.get(revisions_url)
-            req.raise_for_status()
-            revisions = req.text.split("\n")
-            for r in revisions:
-                c += 1
-                if c > count:
-                    return pids
-                pid = f"{include}.{i}.{r}"
-                if verbose:
-                    print(f"Adding pid: {pid}")
-                pids.append(pid)
+    identifiers = asyncio.Queue(maxsize=list_size)
+    counted = asyncio.Event()
+
+    async def list_identifiers(remaining):
+        for s in remaining:
+            identifier_url = f"{env}/eml/{s}"
+            try:
+                for i in split_lines(await get_text(session, identifier_url, semaphore)):
+                    await identifiers.put((s, i))
+            except Exception as e:
+                logger.error(f'Failed to list identifiers: {identifier_url}\n{e}')
+
+    async def list_revisions():
+        nonlocal c
+        while True:
+            s, i = await identifiers.get()
+            try:
+                if c < count:
+                    revisions_url = f"{env}/eml/{s}/{i}"
+                    revisions = split_lines(await get_text(session, revisions_url, semaphore))
+                    for r in revisions:
+                        if c >= count:
+                            break
+                        c += 1
+                        pid = f"{s}.{i}.{r}"
+                        if verbose:
+                            print(f"Adding pid: {pid}")
+                        await queue.put(pid)
+                if c >= count:
+                    counted.set()
+            except Exception as e:
+                logger.error(f'Failed to list revisions: {s}.{i}\n{e}')
+            finally:
+                identifiers.task_done()
+
+    async def list_all():
+        # Scopes are listed as the bounded identifiers queue drains, not all at once
+        remaining = iter(sorted(scopes))
+        await asyncio.gather(*[list_identifiers(remaining) for _ in range(list_size)])
+        await identifiers.join()
+
+    # Listing ends when every scope has been listed or count pids are queued,
+    # whichever comes first; outstanding listing requests are then cancelled
+    listing = asyncio.create_task(list_all())
+    stop = asyncio.create_task(counted.wait())
+    workers = [asyncio.create_task(list_revisions()) for _ in range(list_size)]
+    tasks = [listing, stop] + workers
+    try:
+        await asyncio.wait([listing, stop], return_when=asyncio.FIRST_COMPLETED)
+        if listing.done():
+            listing.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return c
+
+
+async def get_eml(session: aiohttp.ClientSession, pid: str, pasta: str) -> str:
+    package_path = pid.replace('.', '/')
+    eml_url = f'{pasta}/metadata/eml/{package_path}'
+    async with session.get(eml_url) as resp:
+        resp.raise_for_status()
+        return await resp.text()
 
-    return pids
 
+def write_eml(e_dir: str, pid: str, eml: str, verbose: bool):
+    file_path = f'{e_dir}/{pid}.xml'
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(eml)
+    if verbose:
+        print(f'Writing: {file_path}')
 
-async def get_eml(pid: str, pasta: str) -> str:
-    package_path = pid.replace('.', '/')
-    eml_url = f'{pasta}/metadata/eml/{package_path}'
-    async with aiohttp.ClientSession() as session:
-        async with session.get(eml_url) as resp:
-            resp.raise_for_status()
-            return await resp.text()
 
+def is_well_formed(eml: bytes) -> bool:
+    try:
+        etree.fromstring(eml)
+        return True
+    except etree.XMLSyntaxError:
+        return False
 
-async def get_request_block(pids: list, pasta: str, e_dir: str, verbose: bool):
-    tasks = []
 
-    for pid in pids:
-        tasks.append((pid, loop.create_task(get_eml(pid, pasta))))
+def get_existing_pids(e_dir: str, shards: bool, delta: bool, verify: bool, verbose: bool) -> set:
+    """get_existing_pids
+    Return the pids already held in e_dir, read once from the directory
+    listing, shard index or revision store. With verify, each document is
+    also checked for truncation by parsing it; files and shard members that
+    fail are left out of the set so that they are fetched again.
+    """
+    if shards:
+        reader = ShardReader(e_dir)
+        pids = reader.pids()
+        read = lambda pid: reader.get(pid).encode('utf-8')
+    elif delta:
+        store = RevisionStore(f'{e_dir}/revisions.sqlite')
+        pids = store.pids()
+        read = lambda pid: store.get(pid).encode('utf-8')
+    else:
+        with os.scandir(e_dir) as entries:
+            pids = {_.name[:-4] for _ in entries if _.name.endswith('.xml') and _.is_file()}
+        read = lambda pid: Path(f'{e_dir}/{pid}.xml').read_bytes()
+
+    if verify:
+        for pid in sorted(pids):
+            try:
+                valid = is_well_formed(read(pid))
+            except Exception as e:
+                logger.error(f'Failed to read: {pid}\n{e}')
+                valid = False
+            if not valid:
+                if delta:
+                    # Stored revisions are never replaced, so only report them
+                    logger.error(f'Revision store holds invalid EML: {pid}')
+                else:
+                    logger.warning(f'Invalid or truncated EML will be fetched again: {pid}')
+                    pids.discard(pid)
+            elif verbose:
+                print(f'Verified: {pid}')
+
+    if delta:
+        store.close()
+    return pids
 
-    for pid, t in tasks:
+
+async def fetch_worker(
+        session: aiohttp.ClientSession,
+        pasta: str,
+        pids: asyncio.Queue,
+        emls: asyncio.Queue,
+        existing: set,
+        verbose: bool
+):
+    while True:
+        pid = await pids.get()
         try:
-            eml = await t
-            file_path = f'{e_dir}/{pid}.xml'
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(eml)
-                msg = f'Writing: {file_path}'
+            if pid in existing:
                 if verbose:
-                    print(msg)
+                    print(f'Skipping: {pid}')
+                continue
+            eml = await get_eml(session, pid, pasta)
+            await emls.put((pid, eml))
+        except Exception as e:
+            msg = f'Failed to access: {pid}\n{e}'
+            logger.error(msg)
+        finally:
+            pids.task_done()
+
+
+async def write_worker(write, emls: asyncio.Queue):
+    while True:
+        pid, eml = await emls.get()
+        try:
+            await asyncio.to_thread(write, pid, eml)
         except Exception as e:
-            msg = f'Failed to access or write: {pid}\n{e}'
+            msg = f'Failed to write: {pid}\n{e}'
             logger.error(msg)
+        finally:
+            emls.task_done()
+
+
+async def get_all(
+        pasta: str,
+        e_dir: str,
+        count: int,
+        all: bool,
+        include: tuple,
+        exclude: tuple,
+        verbose: bool,
+        request_size: int,
+        list_size: int,
+        shards: bool = False,
+        delta: bool = False,
+        existing: set = frozenset()
+):
+    """get_all
+    Download pipeline: pid enumeration -> fetch workers -> disk writer.
+
+    Each stage is joined to the next by a bounded queue, so a slow stage
+    applies backpressure upstream instead of buffering without limit. The
+    request_size fetch workers share a single session and pick up a new pid
+    as soon as their previous request completes. Pids in existing are
+    passed over without a request.
+    """
+    pids = asyncio.Queue(maxsize=request_size * 2)
+    emls = asyncio.Queue(maxsize=request_size * 2)
+
+    sink = None
+    if shards:
+        sink = ShardWriter(e_dir)
+
+        def write(pid: str, eml: str):
+            sink.write(pid, eml)
+            if verbose:
+                print(f'Archiving: {pid}')
+    elif delta:
+        sink = RevisionStore(f'{e_dir}/revisions.sqlite')
+
+        def write(pid: str, eml: str):
+            sink.put(pid, eml)
+            if verbose:
+                print(f'Storing: {pid}')
+    else:
+        write = functools.partial(write_eml, e_dir, verbose=verbose)
+
+    async with aiohttp.ClientSession() as session:
+        workers = [asyncio.create_task(fetch_worker(session, pasta, pids, emls, existing, verbose)) for _ in range(request_size)]
+        workers.append(asyncio.create_task(write_worker(write, emls)))
+        try:
+            if all:
+                await get_pids_pasta(session, pasta, count, include, exclude, verbose, pids, list_size)
+            else:
+                for pid in get_pids_solr(pasta, count, include, exclude, verbose):
+                    await pids.put(pid)
+            await pids.join()
+            await emls.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if sink is not None:
+                sink.close()
 
 
 env_help = "PASTA+ environment to query: production (default), staging, development"
@@ -140,6 +340,11 @@ include_help = "Include scope(s) e.g. -i scope_1 -i scope_2 ..."
 exclude_help = "Exclude scope(s) e.g. -x scope_1 -x scope_2 ..."
 verbose_help = "Display event information"
 request_size_help = "Number of concurrent requests to PASTA (default 5)"
+list_size_help = "Number of concurrent identifier/revision listing requests to PASTA with --all (default 10)"
+shards_help = "Write EML into rolling zip archive shards with a pid index instead of one file per document"
+delta_help = "Write EML into a delta-compressed revision store (E_DIR/revisions.sqlite) instead of one file per document"
+resume_help = "Skip pids already present in E_DIR"
+verify_help = "Skip pids already present in E_DIR, fetching again any that are truncated or not well-formed XML"
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
 
@@ -152,6 +357,11 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 @click.option('-x', '--exclude', multiple=True, help=exclude_help)
 @click.option('-v', '--verbose', is_flag=True, help=verbose_help)
 @click.option('-r', '--request_size', default=5, help=request_size_help)
+@click.option('-l', '--list_size', default=10, help=list_size_help)
+@click.option('-s', '--shards', is_flag=True, help=shards_help)
+@click.option('-d', '--delta', is_flag=True, help=delta_help)
+@click.option('-R', '--resume', is_flag=True, help=resume_help)
+@click.option('-V', '--verify', is_flag=True, help=verify_help)
 def main(
         e_dir: str,
         env: str,
@@ -160,13 +370,22 @@ def main(
         include: tuple,
         exclude: tuple,
         verbose: bool,
-        request_size: int
+        request_size: int,
+        list_size: int,
+        shards: bool,
+        delta: bool,
+        resume: bool,
+        verify: bool
 ):
 
     if not Path(e_dir).is_dir():
         logger.error(f'Directory "{e_dir}" does not exist')
         exit(1)
 
+    if shards and delta:
+        logger.error('Only one of --shards or --delta may be selected')
+        exit(1)
+
     pasta = None
     if env == 'production':
         pasta = 'https://pasta.lternet.edu/package'
@@ -178,20 +397,14 @@ def main(
         logger.error(f'PASTA environment "{env}" not recognized')
         exit(1)
 
-    if all:
-        pids = get_pids_pasta(pasta, count, include, exclude, verbose)
-    else:
-        pids = get_pids_solr(pasta, count, include, exclude, verbose)
-
-    global loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    existing = frozenset()
+    if resume or verify:
+        existing = get_existing_pids(e_dir, shards, delta, verify, verbose)
 
-    # Execute N requests of pids concurrently
-    i, j = 0, request_size
-    while i < len(pids):
-        loop.run_until_complete(get_request_block(pids[i:j], pasta, e_dir, verbose))
-        i, j = j, j + request_size
+    # Stream pids through N concurrent requests as they are enumerated
+    asyncio.run(
+        get_all(pasta, e_dir, count, all, include, exclude, verbose, request_size, list_size, shards, delta, existing)
+    )
 
     return 0
 
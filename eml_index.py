@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: eml_index
+
+:Synopsis:
+    Parse each EML document of a local directory once and keep the facts
+    used by our analyses (title, funding, entities, physical distributions
+    and units) in a SQLite database with full-text search. Updates are
+    incremental by file mtime and content hash.
+    usage: eml_index.py update /tmp/eml /tmp/eml.sqlite
+           eml_index.py search /tmp/eml.sqlite "nitrogen AND NSF"
+           eml_index.py query /tmp/eml.sqlite "select * from entities where md5 = '...'"
+
+:Created:
+    10/18/26
+"""
+import hashlib
+import io
+from multiprocessing import Pool
+import os
+from pathlib import Path
+import sqlite3
+
+import click
+import daiquiri
+
+from eml_extract import EXTRACTORS, extract
+
+
+logger = daiquiri.getLogger(__name__)
+
+INDEXED = ("title", "funding", "entities", "distributions", "units")
+EML_SUFFIXES = (".xml", ".eml")
+
+SCHEMA = """
+create table if not exists documents (
+    id integer primary key,
+    path text unique not null,
+    mtime_ns integer not null,
+    sha1 text not null,
+    package_id text,
+    scope text,
+    identifier integer,
+    revision integer,
+    title text,
+    funding text
+);
+create index if not exists documents_package_id on documents (package_id);
+create table if not exists entities (
+    doc_id integer not null references documents (id),
+    entity_type text not null,
+    entity_name text,
+    md5 text
+);
+create index if not exists entities_md5 on entities (md5);
+create table if not exists distributions (
+    doc_id integer not null references documents (id),
+    entity_name text,
+    object_name text,
+    url text,
+    medium_name text
+);
+create table if not exists units (
+    doc_id integer not null references documents (id),
+    entity_name text,
+    attribute_name text,
+    unit text,
+    unit_type text not null
+);
+create index if not exists units_unit on units (unit);
+create virtual table if not exists documents_fts using fts5 (
+    package_id unindexed, title, funding, entities
+);
+"""
+
+
+def index_file(path: str) -> tuple:
+    """index_file
+    Returns (path, sha1, record, error) for an EML file.
+    """
+    try:
+        eml = Path(path).read_bytes()
+        record = extract(io.BytesIO(eml), [EXTRACTORS[_] for _ in INDEXED])
+        return path, hashlib.sha1(eml).hexdigest(), record, None
+    except Exception as e:
+        return path, None, None, str(e)
+
+
+def connect(db: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def connect_readonly(db: str) -> sqlite3.Connection:
+    """connect_readonly
+    Opens an existing index read-only, so that a mistyped path is an error
+    rather than a new empty index.
+    """
+    if not Path(db).is_file():
+        msg = f'Index "{db}" does not exist'
+        raise click.ClickException(msg)
+    return sqlite3.connect(Path(db).resolve().as_uri() + "?mode=ro", uri=True)
+
+
+def delete_document(conn: sqlite3.Connection, doc_id: int):
+    for table in ("entities", "distributions", "units"):
+        conn.execute(f"delete from {table} where doc_id=?", (doc_id,))
+    conn.execute("delete from documents_fts where rowid=?", (doc_id,))
+    conn.execute("delete from documents where id=?", (doc_id,))
+
+
+def insert_document(conn: sqlite3.Connection, path: str, mtime_ns: int, sha1: str, record: dict):
+    pid = record["package_id"]
+    scope, identifier, revision = None, None, None
+    if pid is not None and pid.count(".") >= 2:
+        scope, identifier, revision = pid.rsplit(".", 2)
+    sql = (
+        "insert into documents (path, mtime_ns, sha1, package_id, scope, identifier, revision, title, funding) "
+        "values (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    cursor = conn.execute(
+        sql, (path, mtime_ns, sha1, pid, scope, identifier, revision, record["title"], record["funding"])
+    )
+    doc_id = cursor.lastrowid
+    conn.executemany(
+        "insert into entities values (?, ?, ?, ?)",
+        [(doc_id, *_) for _ in record["entities"]]
+    )
+    conn.executemany(
+        "insert into distributions values (?, ?, ?, ?, ?)",
+        [(doc_id, *_) for _ in record["distributions"]]
+    )
+    conn.executemany(
+        "insert into units values (?, ?, ?, ?, ?)",
+        [(doc_id, *_) for _ in record["units"]]
+    )
+    entity_names = " ".join(_[1] for _ in record["entities"] if _[1] is not None)
+    conn.execute(
+        "insert into documents_fts (rowid, package_id, title, funding, entities) values (?, ?, ?, ?, ?)",
+        (doc_id, pid, record["title"], record["funding"], entity_names)
+    )
+
+
+def update(conn: sqlite3.Connection, e_dir: str, workers: int = 1, verbose: bool = False) -> dict:
+    """update
+    Brings the index up to date with the EML files of e_dir. Files whose
+    mtime is unchanged are skipped without being read; files with a new
+    mtime but the same content hash only have their mtime refreshed.
+    Documents whose files are gone are removed from the index.
+    """
+    known = {path: (doc_id, mtime_ns, sha1) for doc_id, path, mtime_ns, sha1 in
+             conn.execute("select id, path, mtime_ns, sha1 from documents")}
+    counts = {"unchanged": 0, "touched": 0, "indexed": 0, "removed": 0, "failed": 0}
+
+    e_dir = os.path.abspath(e_dir)
+    seen = set()
+    mtimes = dict()
+    with os.scandir(e_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(EML_SUFFIXES) and entry.is_file():
+                path = entry.path
+                seen.add(path)
+                mtime_ns = entry.stat().st_mtime_ns
+                if path in known and known[path][1] == mtime_ns:
+                    counts["unchanged"] += 1
+                else:
+                    mtimes[path] = mtime_ns
+
+    with conn:
+        for path in {_ for _ in known if os.path.dirname(_) == e_dir} - seen:
+            delete_document(conn, known[path][0])
+            counts["removed"] += 1
+
+    pool = None
+    if workers > 1:
+        pool = Pool(workers)
+        results = pool.imap_unordered(index_file, sorted(mtimes), 64)
+    else:
+        results = map(index_file, sorted(mtimes))
+
+    try:
+        with conn:
+            for path, sha1, record, error in results:
+                if error is not None:
+                    counts["failed"] += 1
+                    logger.error(f'Failed to index "{path}": {error}')
+                    continue
+                if path in known:
+                    doc_id, mtime_ns, known_sha1 = known[path]
+                    if sha1 == known_sha1:
+                        conn.execute("update documents set mtime_ns=? where id=?", (mtimes[path], doc_id))
+                        counts["touched"] += 1
+                        continue
+                    delete_document(conn, doc_id)
+                insert_document(conn, path, mtimes[path], sha1, record)
+                counts["indexed"] += 1
+                if verbose:
+                    print(f"Indexed: {record['package_id']}")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return counts
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def main():
+    """
+        Queryable SQLite index of a local EML directory.
+    """
+    pass
+
+
+@main.command("update")
+@click.argument("e_dir")
+@click.argument("db")
+@click.option("-w", "--workers", default=1, help="Number of worker processes (default 1, no pool)")
+@click.option("-v", "--verbose", is_flag=True, help="Display event information")
+def update_command(e_dir: str, db: str, workers: int, verbose: bool):
+    """
+        Index new and changed EML files of E_DIR into DB.
+    """
+    if not Path(e_dir).is_dir():
+        msg = f'Directory "{e_dir}" does not exist'
+        raise click.ClickException(msg)
+    conn = connect(db)
+    try:
+        counts = update(conn, e_dir, workers, verbose)
+    finally:
+        conn.close()
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+
+
+@main.command()
+@click.argument("db")
+@click.argument("terms")
+@click.option("-l", "--limit", default=50, help="Maximum number of results (default 50)")
+def search(db: str, terms: str, limit: int):
+    """
+        Full-text search of title, funding and entity names (FTS5 syntax).
+    """
+    conn = connect_readonly(db)
+    sql = (
+        "select package_id, snippet(documents_fts, -1, '[', ']', '...', 12) from documents_fts "
+        "where documents_fts match ? order by rank limit ?"
+    )
+    try:
+        for pid, snippet in conn.execute(sql, (terms, limit)):
+            print(f"{pid}\t{snippet}")
+    except sqlite3.Error as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+
+
+@main.command()
+@click.argument("db")
+@click.argument("sql")
+def query(db: str, sql: str):
+    """
+        Run a read-only SQL query against DB and print the rows as TSV.
+    """
+    conn = connect_readonly(db)
+    try:
+        cursor = conn.execute(sql)
+        if cursor.description is None:
+            # A statement without result columns
+            return
+        print("\t".join(_[0] for _ in cursor.description))
+        for row in cursor:
+            print("\t".join("" if _ is None else str(_) for _ in row))
+    except sqlite3.Error as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
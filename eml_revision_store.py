@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: eml_revision_store
+
+:Synopsis:
+    Delta-compressed store of all EML revisions of data packages. The newest
+    revision of each package is kept in full and every older revision is
+    kept as a line delta against the next newer revision held in the store.
+    No revision is more than MAX_CHAIN deltas away from a full copy: where a
+    delta would exceed that, the revision is kept in full instead.
+    usage: eml_revision_store.py ingest /tmp/eml /tmp/eml/revisions.sqlite
+
+:Created:
+    10/18/26
+"""
+import difflib
+import json
+from pathlib import Path
+import random
+import sqlite3
+import statistics
+import time
+import zlib
+
+import click
+import daiquiri
+
+
+logger = daiquiri.getLogger(__name__)
+
+MAX_CHAIN = 16
+
+SCHEMA = """
+create table if not exists revisions (
+    scope text not null,
+    identifier integer not null,
+    revision integer not null,
+    base integer,
+    size integer not null,
+    data blob not null,
+    primary key (scope, identifier, revision)
+)
+"""
+
+
+def split_pid(pid: str) -> tuple:
+    scope, identifier, revision = pid.rsplit(".", 2)
+    return scope, int(identifier), int(revision)
+
+
+def make_delta(base: str, target: str) -> bytes:
+    """make_delta
+    Encode target as a list of base line ranges to copy ([i1, i2]) and
+    literal text to insert.
+    """
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    ops = []
+    sm = difflib.SequenceMatcher(None, base_lines, target_lines)
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(target_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def chain_depths(bases: dict) -> dict:
+    """chain_depths
+    Returns a dict of revision -> (number of deltas applied to reconstruct
+    it, revision of the full copy it is reconstructed from) for the
+    revisions of a package, given as a dict of revision -> base.
+    """
+    depths = dict()
+    for revision in bases:
+        chain = []
+        while revision not in depths and bases[revision] is not None:
+            chain.append(revision)
+            revision = bases[revision]
+        depth, root = depths.setdefault(revision, (0, revision))
+        for _ in reversed(chain):
+            depth += 1
+            depths[_] = (depth, root)
+    return depths
+
+
+def apply_delta(base: str, delta: bytes) -> str:
+    base_lines = base.splitlines(keepends=True)
+    target = []
+    for op in json.loads(zlib.decompress(delta)):
+        if isinstance(op, list):
+            target.extend(base_lines[op[0]:op[1]])
+        else:
+            target.append(op)
+    return "".join(target)
+
+
+class RevisionStore:
+
+    def __init__(self, db: str):
+        self.conn = sqlite3.connect(db, check_same_thread=False)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __contains__(self, pid: str) -> bool:
+        sql = "select 1 from revisions where scope=? and identifier=? and revision=?"
+        return self.conn.execute(sql, split_pid(pid)).fetchone() is not None
+
+    def pids(self) -> set:
+        sql = "select scope, identifier, revision from revisions"
+        return {f"{s}.{i}.{r}" for s, i, r in self.conn.execute(sql)}
+
+    def _bases(self, scope: str, identifier: int) -> dict:
+        sql = "select revision, base from revisions where scope=? and identifier=?"
+        return dict(self.conn.execute(sql, (scope, identifier)).fetchall())
+
+    def _get(self, scope: str, identifier: int, revision: int) -> str:
+        # Follow base links up to the full revision, then apply deltas back down
+        chain = []
+        sql = "select base, data from revisions where scope=? and identifier=? and revision=?"
+        while True:
+            row = self.conn.execute(sql, (scope, identifier, revision)).fetchone()
+            if row is None:
+                msg = f"Package '{scope}.{identifier}.{revision}' not found in revision store"
+                raise KeyError(msg)
+            base, data = row
+            if base is None:
+                eml = zlib.decompress(data).decode("utf-8")
+                break
+            chain.append(data)
+            revision = base
+        for delta in reversed(chain):
+            eml = apply_delta(eml, delta)
+        return eml
+
+    def get(self, pid: str) -> str:
+        return self._get(*split_pid(pid))
+
+    def put(self, pid: str, eml: str):
+        """put
+        Add a revision. A revision newer than any held for the package is
+        stored in full and the previous newest is re-encoded as a delta
+        against it; an older revision is stored as a delta against the
+        next newer revision present. A revision that would then be more than
+        MAX_CHAIN deltas away from a full copy is kept in full instead.
+        """
+        scope, identifier, revision = split_pid(pid)
+        if pid in self:
+            return
+        size = len(eml.encode("utf-8"))
+        sql = "select min(revision) from revisions where scope=? and identifier=? and revision>?"
+        newer = self.conn.execute(sql, (scope, identifier, revision)).fetchone()[0]
+        with self.conn:
+            if newer is None:
+                sql = "select max(revision) from revisions where scope=? and identifier=?"
+                newest = self.conn.execute(sql, (scope, identifier)).fetchone()[0]
+                if newest is not None:
+                    # Re-encoding the newest adds a delta to every chain ending at it
+                    depths = chain_depths(self._bases(scope, identifier))
+                    longest = max(d for d, root in depths.values() if root == newest)
+                if newest is not None and longest < MAX_CHAIN:
+                    delta = make_delta(eml, self._get(scope, identifier, newest))
+                    sql = "update revisions set base=?, data=? where scope=? and identifier=? and revision=?"
+                    self.conn.execute(sql, (revision, delta, scope, identifier, newest))
+                base, data = None, zlib.compress(eml.encode("utf-8"), 9)
+            elif chain_depths(self._bases(scope, identifier))[newer][0] < MAX_CHAIN:
+                base, data = newer, make_delta(self._get(scope, identifier, newer), eml)
+            else:
+                base, data = None, zlib.compress(eml.encode("utf-8"), 9)
+            sql = "insert into revisions values (?, ?, ?, ?, ?, ?)"
+            self.conn.execute(sql, (scope, identifier, revision, base, size, data))
+
+    def stats(self, sample: int = 100) -> dict:
+        sql = "select count(*), sum(base is null), sum(size), sum(length(data)) from revisions"
+        revisions, full, size, stored = self.conn.execute(sql).fetchone()
+        stats = {
+            "revisions": revisions,
+            "full": full or 0,
+            "deltas": revisions - (full or 0),
+            "bytes": size or 0,
+            "stored_bytes": stored or 0,
+            "compression_ratio": round(size / stored, 2) if stored else None,
+        }
+        packages = dict()
+        sql = "select scope, identifier, revision, base from revisions"
+        for scope, identifier, revision, base in self.conn.execute(sql):
+            packages.setdefault((scope, identifier), dict())[revision] = base
+        depths = [d for _ in packages.values() for d, root in chain_depths(_).values()]
+        if depths:
+            stats["chain_depth"] = {
+                "max_allowed": MAX_CHAIN,
+                "mean": round(statistics.mean(depths), 3),
+                "max": max(depths),
+            }
+        pids = sorted(self.pids())
+        latencies = []
+        for pid in random.sample(pids, min(sample, len(pids))):
+            start = time.perf_counter()
+            self.get(pid)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if latencies:
+            stats["reconstruction_ms"] = {
+                "sampled": len(latencies),
+                "mean": round(statistics.mean(latencies), 3),
+                "median": round(statistics.median(latencies), 3),
+                "max": round(max(latencies), 3),
+            }
+        return stats
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def main():
+    """
+        Delta-compressed store of EML revisions.
+    """
+    pass
+
+
+@main.command()
+@click.argument("e_dir")
+@click.argument("db")
+@click.option("-v", "--verbose", is_flag=True, help="Display event information")
+def ingest(e_dir: str, db: str, verbose: bool):
+    """
+        Add the EML files ({pid}.xml) in E_DIR to the revision store DB.
+    """
+    if not Path(e_dir).is_dir():
+        msg = f'Directory "{e_dir}" does not exist'
+        raise click.ClickException(msg)
+    with RevisionStore(db) as store:
+        for eml_f in sorted(Path(e_dir).glob("*.xml")):
+            try:
+                store.put(eml_f.stem, eml_f.read_text(encoding="utf-8"))
+                if verbose:
+                    print(f"Storing: {eml_f.stem}")
+            except Exception as e:
+                logger.error(f"Failed to store: {eml_f}\n{e}")
+
+
+@main.command()
+@click.argument("db")
+@click.argument("pid")
+def get(db: str, pid: str):
+    """
+        Print revision PID reconstructed from the revision store DB.
+    """
+    with RevisionStore(db) as store:
+        if pid not in store:
+            msg = f"Package '{pid}' not found in '{db}'"
+            raise click.ClickException(msg)
+        print(store.get(pid))
+
+
+@main.command()
+@click.argument("db")
+@click.option("-s", "--sample", default=100, help="Number of revisions to time reconstruction of (default 100)")
+def stats(db: str, sample: int):
+    """
+        Report compression ratio and reconstruction latency of the store DB.
+    """
+    with RevisionStore(db) as store:
+        print(json.dumps(store.stats(sample), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: eml_shards
+
+:Synopsis:
+    Store EML documents in rolling zip archive shards with a sidecar index
+    of pid -> (shard, offset) for random access.
+    usage: eml_shards.py get /tmp/eml knb-lter-nwk.1424.1
+
+:Created:
+    10/18/26
+"""
+import csv
+from pathlib import Path
+import struct
+import zipfile
+import zlib
+
+import click
+import daiquiri
+
+
+logger = daiquiri.getLogger(__name__)
+
+# Fixed portion of a zip local file header (APPNOTE 4.3.7)
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+def index_path(s_dir: str, prefix: str) -> Path:
+    return Path(s_dir) / f"{prefix}-index.tsv"
+
+
+class ShardWriter:
+    """ShardWriter
+    Appends documents to numbered zip shards ({prefix}-00000.zip, ...) and
+    rolls to a new shard once max_docs or max_bytes is reached. Index rows
+    for a shard are only written once the shard is closed, so the index
+    never references a shard that is incomplete on disk.
+    """
+
+    def __init__(self, s_dir: str, prefix: str = "eml", max_docs: int = 10000, max_bytes: int = 256 * 1024**2):
+        self.s_dir = Path(s_dir)
+        self.prefix = prefix
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        existing = [int(_.stem.rsplit("-", 1)[1]) for _ in self.s_dir.glob(f"{prefix}-[0-9]*.zip")]
+        self.shard_number = max(existing, default=-1)
+        self.shard = None
+        self.zf = None
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open_shard(self):
+        self.shard_number += 1
+        self.shard = f"{self.prefix}-{self.shard_number:05d}.zip"
+        self.zf = zipfile.ZipFile(self.s_dir / self.shard, "w", compression=zipfile.ZIP_DEFLATED)
+        self.rows = []
+
+    def _close_shard(self):
+        if self.zf is None:
+            return
+        self.zf.close()
+        with open(index_path(self.s_dir, self.prefix), "a", newline="") as f:
+            csv.writer(f, delimiter="\t").writerows(self.rows)
+        self.zf = None
+        self.rows = []
+
+    def write(self, pid: str, eml: str):
+        if self.zf is None:
+            self._open_shard()
+        self.zf.writestr(f"{pid}.xml", eml.encode("utf-8"))
+        info = self.zf.infolist()[-1]
+        self.rows.append(
+            (pid, self.shard, info.header_offset, info.compress_size, info.file_size, info.compress_type)
+        )
+        if len(self.rows) >= self.max_docs or self.zf.fp.tell() >= self.max_bytes:
+            self._close_shard()
+
+    def close(self):
+        self._close_shard()
+
+
+class ShardReader:
+    """ShardReader
+    Random access to documents written by ShardWriter through the sidecar
+    index; iteration reads each shard front to back in offset order.
+    """
+
+    def __init__(self, s_dir: str, prefix: str = "eml"):
+        self.s_dir = Path(s_dir)
+        self.index = dict()
+        p = index_path(s_dir, prefix)
+        if p.exists():
+            with open(p, "r", newline="") as f:
+                for pid, shard, offset, length, size, method in csv.reader(f, delimiter="\t"):
+                    self.index[pid] = (shard, int(offset), int(length), int(size), int(method))
+
+    def __contains__(self, pid: str) -> bool:
+        return pid in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def pids(self) -> set:
+        return set(self.index)
+
+    @staticmethod
+    def _read(f, offset: int, length: int, method: int) -> str:
+        f.seek(offset)
+        header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            msg = f"No zip local file header at offset {offset}"
+            raise ValueError(msg)
+        name_length, extra_length = header[-2], header[-1]
+        f.seek(name_length + extra_length, 1)
+        data = f.read(length)
+        if method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif method != zipfile.ZIP_STORED:
+            msg = f"Unsupported zip compression method {method}"
+            raise ValueError(msg)
+        return data.decode("utf-8")
+
+    def get(self, pid: str) -> str:
+        shard, offset, length, size, method = self.index[pid]
+        with open(self.s_dir / shard, "rb") as f:
+            return self._read(f, offset, length, method)
+
+    def __iter__(self):
+        entries = sorted(self.index.items(), key=lambda _: (_[1][0], _[1][1]))
+        f, current = None, None
+        try:
+            for pid, (shard, offset, length, size, method) in entries:
+                if shard != current:
+                    if f is not None:
+                        f.close()
+                    f, current = open(self.s_dir / shard, "rb"), shard
+                yield pid, self._read(f, offset, length, method)
+        finally:
+            if f is not None:
+                f.close()
+
+
+def drop_pids(s_dir: str, pids: set, prefix: str = "eml") -> int:
+    """drop_pids
+    Removes pids from the sidecar index and returns the number of index
+    rows removed. Shards are not rewritten: the documents stay in their
+    shards but can no longer be reached through ShardReader.
+    """
+    p = index_path(s_dir, prefix)
+    if not p.exists():
+        return 0
+    with open(p, "r", newline="") as f:
+        rows = list(csv.reader(f, delimiter="\t"))
+    kept = [_ for _ in rows if _[0] not in pids]
+    tmp = p.with_name(p.name + ".tmp")
+    with open(tmp, "w", newline="") as f:
+        csv.writer(f, delimiter="\t").writerows(kept)
+    tmp.replace(p)
+    return len(rows) - len(kept)
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def main():
+    """
+        Read EML documents from zip archive shards.
+    """
+    pass
+
+
+@main.command()
+@click.argument("s_dir")
+@click.argument("pid")
+def get(s_dir: str, pid: str):
+    """
+        Print the EML document PID from the shards in S_DIR.
+    """
+    reader = ShardReader(s_dir)
+    if pid not in reader:
+        msg = f"Package '{pid}' not found in '{s_dir}'"
+        raise click.ClickException(msg)
+    print(reader.get(pid))
+
+
+@main.command()
+@click.argument("s_dir")
+def ls(s_dir: str):
+    """
+        List the pids and shards in S_DIR in storage order.
+    """
+    reader = ShardReader(s_dir)
+    for pid, (shard, offset, length, size, method) in sorted(reader.index.items(), key=lambda _: _[1][:2]):
+        print(f"{pid}\t{shard}\t{offset}\t{size}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,6 @@
 import logging
 import hashlib
 from pathlib import Path
-from typing import List
 
 import click
 import daiquiri
@@ -32,13 +31,46 @@ def get_md5(entity_name: str) -> str:
     return hashval.hexdigest()
 
 
-def get_entity_names(datasets) -> List:
-    names = list()
-    for dataset in datasets:
-        if dataset is not None:
-            entity_name = dataset.find(".//entityName")
-            names.append(entity_name.text.strip())
-    return names
+ENTITY_TYPES = ("dataTable", "spatialRaster", "spatialVector", "otherEntity")
+
+
+def encode_entities(source) -> tuple:
+    """encode_entities
+    Returns the package id of the EML document source (a file name or file
+    object) and a list of (entity type, entity name, md5) for each entity of
+    its dataset, in document order.
+
+    The document is parsed once with iterparse: each name is hashed as soon
+    as its entityName element ends, and each entity subtree is discarded as
+    soon as the entity ends. Elements are matched by local name, so the EML
+    namespace prefix, or the lack of one, does not matter.
+    """
+    pid = None
+    root = None
+    entities = list()
+    for event, element in etree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+                pid = root.get("packageId")
+            continue
+        tag = etree.QName(element).localname
+        parent = element.getparent()
+        if parent is None:
+            continue
+        if tag == "entityName":
+            entity = parent
+            dataset = entity.getparent()
+            entity_type = etree.QName(entity).localname
+            if (entity_type in ENTITY_TYPES and dataset is not None and dataset.getparent() is root
+                    and etree.QName(dataset).localname == "dataset"):
+                name = (element.text or "").strip()
+                entities.append((entity_type, name, get_md5(name)))
+        elif parent is root or parent.getparent() is root:
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+    return pid, entities
 
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -58,21 +90,9 @@ def main(eml: str):
         msg = f"File '{eml}' not found."
         raise FileNotFoundError(msg)
 
-    eml_file = p.read_text()
-
-    names = list()
-    xml = etree.fromstring(eml_file.encode("utf"))
-    datatables = xml.findall("./dataset/dataTable")
-    names += get_entity_names(datatables)
-    spatialrasters = xml.findall("./dataset/spatialRaster")
-    names += get_entity_names(spatialrasters)
-    spatialvectors = xml.findall("./dataset/spatialVector")
-    names += get_entity_names(spatialvectors)
-    otherentities = xml.findall("./dataset/otherEntity")
-    names += get_entity_names(otherentities)
-
-    for name in names:
-        md5 = get_md5(name)
+    pid, entities = encode_entities(str(p))
+
+    for entity_type, name, md5 in entities:
         print(f"{md5} - {name}")
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: entity_name_index
+
+:Synopsis:
+    Corpus-wide index of PASTA entity name MD5s for reverse lookup of the
+    package, entity type and entity name an MD5 belongs to.
+    usage: entity_name_index.py build /tmp/eml /tmp/entities.idx
+           entity_name_index.py lookup /tmp/entities.idx 2697f267c63d412816dbda60a083ffe8
+
+    The index is a single file: a header, a table of fixed-width records
+    (16 byte MD5 digest, 8 byte string offset) sorted by digest, and a
+    string table of length-prefixed "package id<TAB>entity type<TAB>name"
+    entries. Lookups memory-map the file and binary search the record table,
+    so only the pages touched by the search are read.
+
+:Created:
+    10/18/26
+"""
+import mmap
+from multiprocessing import Pool
+from pathlib import Path
+import re
+import struct
+
+import click
+import daiquiri
+
+from entity_name_encoder import encode_entities
+
+
+logger = daiquiri.getLogger('entity_name_index: ' + __name__)
+
+MAGIC = b"ENIX"
+VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+RECORD = struct.Struct("<16sQ")
+LENGTH = struct.Struct("<I")
+MD5 = re.compile(r"[0-9a-fA-F]{32}")
+
+
+def encode_file(path: str) -> tuple:
+    """encode_file
+    Returns (path, [(md5, package id, entity type, name), ...], error).
+    """
+    try:
+        pid, entities = encode_entities(path)
+        return path, [(md5, pid, entity_type, name) for entity_type, name, md5 in entities], None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def write_index(index: str, entries: set):
+    entries = sorted(entries)
+    strings = bytearray()
+    records = bytearray()
+    for md5, pid, entity_type, name in entries:
+        records += RECORD.pack(bytes.fromhex(md5), len(strings))
+        value = f"{pid}\t{entity_type}\t{name}".encode("utf-8")
+        strings += LENGTH.pack(len(value)) + value
+    with open(index, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        f.write(records)
+        f.write(strings)
+
+
+def lookup(index: str, md5: str) -> list:
+    """lookup
+    Returns [(package id, entity type, name), ...] for md5 in O(log n)
+    record reads of the memory-mapped index.
+    """
+    digest = bytes.fromhex(md5)
+    with open(index, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            magic, version, count = HEADER.unpack_from(m, 0)
+            if magic != MAGIC or version != VERSION:
+                msg = f"'{index}' is not an entity name index"
+                raise ValueError(msg)
+            strings_start = HEADER.size + count * RECORD.size
+
+            def digest_at(i: int) -> bytes:
+                return m[HEADER.size + i * RECORD.size:HEADER.size + i * RECORD.size + 16]
+
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if digest_at(mid) < digest:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            matches = []
+            while lo < count:
+                d, offset = RECORD.unpack_from(m, HEADER.size + lo * RECORD.size)
+                if d != digest:
+                    break
+                start = strings_start + offset
+                length = LENGTH.unpack_from(m, start)[0]
+                value = m[start + LENGTH.size:start + LENGTH.size + length].decode("utf-8")
+                matches.append(tuple(value.split("\t", 2)))
+                lo += 1
+    return matches
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def main():
+    """
+        Reverse lookup of PASTA entity name MD5s.
+    """
+    pass
+
+
+@main.command()
+@click.argument("e_dir")
+@click.argument("index")
+@click.option("-w", "--workers", default=1, help="Number of worker processes (default 1, no pool)")
+def build(e_dir: str, index: str, workers: int):
+    """
+        Encode every entity of the EML files in E_DIR and write INDEX.
+    """
+    if not Path(e_dir).is_dir():
+        msg = f'Directory "{e_dir}" does not exist'
+        raise click.ClickException(msg)
+
+    paths = [str(_) for _ in Path(e_dir).iterdir() if _.suffix in (".xml", ".eml")]
+    pool = None
+    if workers > 1:
+        pool = Pool(workers)
+        results = pool.imap_unordered(encode_file, paths, 64)
+    else:
+        results = map(encode_file, paths)
+
+    entries = set()
+    failed = 0
+    try:
+        for path, encoded, error in results:
+            if error is not None:
+                failed += 1
+                logger.error(f'Failed to parse "{path}": {error}')
+            else:
+                entries.update(encoded)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    write_index(index, entries)
+    print(f"Indexed {len(entries)} entities from {len(paths) - failed} EML files")
+
+
+@main.command("lookup")
+@click.argument("index")
+@click.argument("md5", nargs=-1, required=True)
+def lookup_command(index: str, md5: tuple):
+    """
+        Print the package id, entity type and entity name of each MD5.
+    """
+    if not Path(index).is_file():
+        msg = f'Index "{index}" does not exist'
+        raise click.ClickException(msg)
+    for m in md5:
+        if not MD5.fullmatch(m):
+            msg = f"'{m}' is not an MD5 of 32 hexadecimal characters"
+            raise click.ClickException(msg)
+    for m in md5:
+        try:
+            matches = lookup(index, m)
+        except (OSError, ValueError, struct.error) as e:
+            msg = f"Failed to read index '{index}': {e}"
+            raise click.ClickException(msg)
+        if len(matches) == 0:
+            print(f"{m}\tnot found")
+        for pid, entity_type, name in matches:
+            print(f"{m}\t{pid}\t{entity_type}\t{name}")
+
+
+if __name__ == "__main__":
+    main()
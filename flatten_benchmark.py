@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: flatten_benchmark
+
+:Synopsis:
+    Micro-benchmark of project.flatten against the former recursive
+    implementation on deep, synthetic funding trees.
+    usage: flatten_benchmark.py --depth 200 --breadth 3 --repeat 5
+
+:Created:
+    10/18/26
+"""
+import timeit
+
+import click
+from lxml import etree
+
+from project import flatten
+
+
+def flatten_recursive(element):
+    # Former project.flatten, retained for comparison
+    t = ''
+    if hasattr(element, 'text') and element.text is not None:
+        t = element.text.strip().replace('\t', '').replace('\n', '').replace('\r', '')
+    if hasattr(element, '__iter__'):
+        for e in element:
+            t += flatten_recursive(e)
+    return t
+
+
+def make_funding(depth: int, breadth: int, words: int) -> etree._Element:
+    """make_funding
+    Builds a funding element nesting depth levels of section elements, each
+    holding breadth para children of words words apiece.
+    """
+    funding = etree.Element('funding')
+    parent = funding
+    text = '\n\t '.join(['NSF DEB-0000000'] * words)
+    for _ in range(depth):
+        for _ in range(breadth):
+            etree.SubElement(parent, 'para').text = text
+        parent = etree.SubElement(parent, 'section')
+        parent.text = text
+    return funding
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('-d', '--depth', default=200, help='Nesting depth of the funding tree (default 200)')
+@click.option('-b', '--breadth', default=3, help='Para elements per level (default 3)')
+@click.option('-w', '--words', default=20, help='Words of text per element (default 20)')
+@click.option('-r', '--repeat', default=5, help='Timing repetitions; the best is reported (default 5)')
+def main(depth: int, breadth: int, words: int, repeat: int):
+    """
+        Compare project.flatten with the former recursive implementation.
+    """
+    print(f'{"depth":>6} {"chars":>10} {"recursive ms":>13} {"flatten ms":>11} {"speedup":>8}')
+    depths = sorted({min(2 ** _, depth) for _ in range(depth.bit_length() + 1)})
+    for d in depths:
+        funding = make_funding(d, breadth, words)
+        number = max(1, 2000 // d)
+        old = min(timeit.repeat(lambda: flatten_recursive(funding), number=number, repeat=repeat)) / number
+        new = min(timeit.repeat(lambda: flatten(funding), number=number, repeat=repeat)) / number
+        chars = len(flatten(funding))
+        print(f'{d:>6} {chars:>10} {old * 1000:>13.3f} {new * 1000:>11.3f} {old / new:>7.1f}x')
+    return 0
+
+
+if __name__ == "__main__":
+    main()
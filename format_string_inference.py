@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: format_string_inference
+
+:Synopsis:
+    Infer the EML formatString of date and time columns from their values,
+    the reverse of format_string_parser.format_string_visitor.
+    usage: format_string_inference.py table.csv
+           format_string_inference.py -c date -c time -s 5000 table.csv
+
+    Every format string the datetime grammar can produce is enumerated once
+    and indexed by its shape: the format string with each of its digit
+    placeholders (Y, M, D, h, m, s) replaced by "9". The shape of a value
+    (its digits replaced by "9") is then one dictionary lookup away from the
+    few format strings that can match it, so each value is classified in a
+    single pass instead of being tried against every format's regex; only
+    the regexes of those candidates are run, to check value ranges.
+
+    Where several format strings match all of a column's values (e.g. 2020
+    is a YYYY or an hhmm), the grammar's first alternative is inferred, so
+    dates win over times of the same shape (2020 is YYYY). The other
+    candidates are reported alongside.
+
+:Created:
+    10/18/26
+"""
+import csv
+from functools import lru_cache
+import itertools
+import json
+from pathlib import Path
+import random
+import re
+import sys
+
+import click
+import daiquiri
+from parsimonious.expressions import Literal, OneOf, Regex, Sequence
+
+from format_string_parser import GRAMMAR, format_string_visitor
+
+
+logger = daiquiri.getLogger(__name__)
+
+SAMPLE_SIZE = 10000
+CANDIDATES = 5
+
+# Format string spellings of the grammar's regex rules, in order of preference
+REGEX_RULES = {
+    "dateDash": ("-", ""),
+    "timeColon": (":", ""),
+    "T": ("T", " ", ""),
+    "offsetOperator": ("+", "-"),
+    "Z": ("Z", ""),
+}
+FORMAT_SHAPE = str.maketrans("YMDhms", "999999")
+VALUE_SHAPE = str.maketrans("0123456789", "9999999999")
+
+
+def expand(expression) -> list:
+    """expand
+    Returns every string matched by a parsimonious grammar expression, in
+    the order of preference of its alternatives.
+    """
+    if isinstance(expression, Literal):
+        return [expression.literal]
+    if isinstance(expression, Regex):
+        return list(REGEX_RULES[expression.name])
+    if isinstance(expression, OneOf):
+        return [_ for member in expression.members for _ in expand(member)]
+    if isinstance(expression, Sequence):
+        return ["".join(_) for _ in itertools.product(*(expand(m) for m in expression.members))]
+    msg = f"Cannot enumerate grammar expression '{expression.name}' of type {type(expression).__name__}"
+    raise ValueError(msg)
+
+
+@lru_cache(maxsize=None)
+def format_strings() -> tuple:
+    """format_strings
+    Returns the (format string, compiled regex) of every format string of
+    the datetime grammar, most preferred first.
+    """
+    formats = []
+    for format_string in dict.fromkeys(expand(GRAMMAR["validDateTime"])):
+        try:
+            formats.append((format_string, re.compile(format_string_visitor(format_string))))
+        except Exception:
+            # An ordered choice of the grammar may not accept every spelling
+            continue
+    return tuple(formats)
+
+
+@lru_cache(maxsize=None)
+def shape_index() -> dict:
+    """shape_index
+    Returns a dict of shape -> [(preference, format string, regex), ...],
+    where preference is the format string's position in format_strings().
+    """
+    index = dict()
+    for preference, (format_string, pattern) in enumerate(format_strings()):
+        shape = format_string.translate(FORMAT_SHAPE)
+        index.setdefault(shape, []).append((preference, format_string, pattern))
+    return index
+
+
+class Reservoir:
+    """Reservoir
+    Uniform random sample of at most size of the non-empty values added,
+    kept in one pass over a column of unknown length.
+    """
+
+    def __init__(self, size: int = SAMPLE_SIZE, rng: random.Random = None):
+        self.size = size
+        self.rng = random.Random(0) if rng is None else rng
+        self.count = 0
+        self.values = []
+
+    def add(self, value: str):
+        value = value.strip()
+        if value == "":
+            return
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            i = self.rng.randrange(self.count)
+            if i < self.size:
+                self.values[i] = value
+
+
+def infer_format(values: list, min_match: float = 1.0) -> tuple:
+    """infer_format
+    Returns the inferred format string of values (None if no format string
+    matches at least min_match of them) and the candidates as [(format
+    string, number of values matched), ...], best first.
+    """
+    index = shape_index()
+    shapes = dict()
+    for value in values:
+        shapes.setdefault(value.translate(VALUE_SHAPE), []).append(value)
+
+    matched = dict()
+    for shape, shape_values in shapes.items():
+        for preference, format_string, pattern in index.get(shape, ()):
+            n = sum(1 for _ in shape_values if pattern.fullmatch(_))
+            if n > 0:
+                matched[(preference, format_string)] = n
+
+    candidates = sorted(matched.items(), key=lambda _: (-_[1], _[0]))
+    candidates = [(format_string, n) for (_, format_string), n in candidates]
+    if len(values) == 0 or len(candidates) == 0 or candidates[0][1] < min_match * len(values):
+        return None, candidates
+    return candidates[0][0], candidates
+
+
+def column_indexes(header: list, columns: list) -> list:
+    """column_indexes
+    Returns the 0-based indexes of columns given by header name or 1-based
+    index.
+    """
+    indexes = []
+    for column in columns:
+        if column.isdigit():
+            indexes.append(int(column) - 1)
+        elif column in header:
+            indexes.append(header.index(column))
+        else:
+            msg = f"Column '{column}' not found in the header"
+            raise ValueError(msg)
+    return indexes
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument("table")
+@click.option("-c", "--column", "columns", multiple=True,
+              help="Column(s) to infer, by header name or 1-based index (default all)")
+@click.option("-s", "--sample", default=SAMPLE_SIZE, help=f"Values sampled per column (default {SAMPLE_SIZE})")
+@click.option("-m", "--min_match", default=1.0, help="Fraction of sampled values a format must match (default 1.0)")
+@click.option("-d", "--delimiter", default=",", help="Field delimiter (default ',')")
+@click.option("--header_lines", default=1, help="Number of header lines (default 1)")
+@click.option("-o", "--output", default=None, help="JSON report file (defaults to stdout)")
+def main(table: str, columns: tuple, sample: int, min_match: float, delimiter: str, header_lines: int, output: str):
+    """
+        Infer the EML formatString of the date and time columns of the CSV
+        data TABLE from a sample of each column's values.
+    """
+    if not Path(table).is_file():
+        msg = f'Table "{table}" does not exist'
+        raise click.ClickException(msg)
+    if sample < 1:
+        msg = "Sample must be a positive number of values"
+        raise click.ClickException(msg)
+
+    with open(table, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, []) if header_lines > 0 else []
+        for _ in range(header_lines - 1):
+            next(reader, None)
+        try:
+            indexes = column_indexes(header, list(columns))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        first = next(reader, None)
+        if first is None:
+            msg = f'Table "{table}" has no records'
+            raise click.ClickException(msg)
+        if len(indexes) == 0:
+            indexes = list(range(max(len(header), len(first))))
+        # One reservoir per column, filled from a single pass over the table
+        rng = random.Random(0)
+        reservoirs = {i: Reservoir(sample, rng) for i in indexes}
+        for row in itertools.chain([first], reader):
+            for i in indexes:
+                if i < len(row):
+                    reservoirs[i].add(row[i])
+
+    report = []
+    for i in indexes:
+        count, values = reservoirs[i].count, reservoirs[i].values
+        format_string, candidates = infer_format(values, min_match)
+        name = header[i] if i < len(header) else str(i + 1)
+        report.append({
+            "column": name,
+            "index": i + 1,
+            "values": count,
+            "sampled": len(values),
+            "format_string": format_string,
+            "candidates": [{"format_string": f, "matched": n} for f, n in candidates[:CANDIDATES]],
+        })
+        if format_string is not None:
+            logger.info(f"Column '{name}': {format_string}")
+
+    r = sys.stdout if output is None else open(output, "w")
+    try:
+        json.dump(report, r, indent=2)
+        r.write("\n")
+    finally:
+        if output is not None:
+            r.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,12 @@
     4/3/2018
 """
 
+from array import array
 from docopt import docopt
+from functools import lru_cache
+import itertools
 import logging
+from multiprocessing import Pool
 from parsimonious.nodes import Node, NodeVisitor
 from parsimonious.grammar import Grammar
 import sys
@@ -25,8 +29,29 @@ logging.basicConfig(format='%(asctime)s %(levelname)s (%(name)s): %(message)s',
 logger = logging.getLogger('format_string_parser')
 
 
+FORMAT_STRING_CACHE_SIZE = 1024
+BATCH_CHUNK = 10000
+
+
 class FormatStringFormatter(NodeVisitor):
-    """Visitor that turns a parse tree into a regular expression"""
+    """Visitor that turns a parse tree into a regular expression
+
+    The fields of the format string are also recorded, in order, in fields
+    as (name, width) pairs, where name is None for literal text. Every field
+    of the grammar has a fixed width, so the fields give the offset of each
+    value component for compile_parser().
+    """
+
+    def __init__(self):
+        self.fields = []
+
+    def field(self, name, width):
+        self.fields.append((name, width))
+
+    def literal(self, text):
+        if text:
+            self.fields.append((None, text))
+        return text
 
     def visit_validDateTime(self, node, visited_children):
         return '^' + ''.join(visited_children) + '$'
@@ -71,36 +96,43 @@ class FormatStringFormatter(NodeVisitor):
         return ''.join(visited_children)
     
     def visit_year(self, node, visited_children):
+        self.field('year', 4)
         return r'(\d\d\d\d)'
     
     def visit_month(self, node, visited_children):
+        self.field('month', 2)
         return r'(01|02|03|04|05|06|07|08|09|10|11|12)'
     
     def visit_yearMonth(self, node, visited_children):
         return ''.join(visited_children)
     
     def visit_dayOfMonth(self, node, visited_children):
+        self.field('day', 2)
         return r'(0[1-9]|[1-2]\d|30|31)'
     
     def visit_dateDash(self, node, visited_children):
-        return node.text
+        return self.literal(node.text)
     
     def visit_timeColon(self, node, visited_children):
-        return node.text
+        return self.literal(node.text)
     
     def visit_T(self, node, visited_children):
-        return node.text
+        return self.literal(node.text)
     
     def visit_hours(self, node, visited_children):
+        self.field('hour', 2)
         return r'([0-1]\d|2[0-4])'
     
     def visit_minutes(self, node, visited_children):
+        self.field('minute', 2)
         return r'([0-5]\d)'
     
     def visit_wholeSeconds(self, node, visited_children):
+        self.field('second', 2)
         return r'([0-5]\d)'
     
     def visit_fractionalSeconds(self, node, visited_children):
+        self.field('fraction', 4)
         return r'(\.\d\d\d)'
     
     def visit_secondsWithFraction(self, node, visited_children):
@@ -113,9 +145,11 @@ class FormatStringFormatter(NodeVisitor):
         return ''.join(visited_children)
     
     def visit_dayOfYear(self, node, visited_children):
+        self.field('doy', 3)
         return r'[0-3]\d\d'
     
     def visit_offsetOperator(self, node, visited_children):
+        self.field('sign', 1)
         return '\\' + node.text
     
     def visit_offset(self, node, visited_children):
@@ -128,11 +162,10 @@ class FormatStringFormatter(NodeVisitor):
         return ''.join(visited_children)
     
     def visit_Z(self, node, visited_children):
-        return node.text
+        return self.literal(node.text)
     
 
-def format_string_visitor(format_string):
-    grammar = Grammar(
+GRAMMAR = Grammar(
     """
     validDateTime = monthBasedDateTime / dayBasedDateTime / monthBasedDate \
                     / dayBasedDate / yearMonth / year / timeZ
@@ -171,12 +204,197 @@ def format_string_visitor(format_string):
     offsetHoursMinutes = offsetOperator hours timeColon minutes
     Z = ~"Z?"   
     """)
-    
-    tree = grammar.parse(format_string)
+
+
+@lru_cache(maxsize=FORMAT_STRING_CACHE_SIZE)
+def format_string_visitor(format_string):
+    tree = GRAMMAR.parse(format_string)
     result = FormatStringFormatter().visit(tree)
     return result
 
 
+PARSER_TEMPLATE = """
+def parse(value):
+    if %(checks)s:
+        raise ValueError('%%r does not match format string %(format_string)s' %% value)
+%(date_body)s
+%(time_body)s
+    return %(result)s
+
+
+def parse_all(values):
+    out = array('%(typecode)s')
+    append = out.append
+    dates = dict()
+    for value in values:
+        if %(checks)s:
+            raise ValueError('%%r does not match format string %(format_string)s' %% value)
+%(loop_date_body)s
+%(loop_time_body)s
+        append(%(result)s)
+    return out
+"""
+
+
+@lru_cache(maxsize=FORMAT_STRING_CACHE_SIZE)
+def format_string_fields(format_string):
+    """Returns the (name, start, end) of each field of a format string,
+    with name None for literal text and offset_hour and offset_minute for
+    the hours and minutes of a UTC offset"""
+    formatter = FormatStringFormatter()
+    formatter.visit(GRAMMAR.parse(format_string))
+    fields = []
+    start = 0
+    offset = False
+    for name, width in formatter.fields:
+        if name is None:
+            width = len(width)
+        elif name == 'sign':
+            offset = True
+        elif offset:
+            name = 'offset_' + name
+        fields.append((name, start, start + width))
+        start += width
+    return tuple(fields)
+
+
+def parser_source(format_string):
+    """Returns the source of the parse functions of a format string"""
+    fields = format_string_fields(format_string)
+    checks = ['len(value) != %d' % (fields[-1][2] if fields else 0)]
+    date_fields = []
+    time_body = []
+    names = set()
+    for name, start, end in fields:
+        if name is None:
+            checks.append('value[%d:%d] != %r' % (start, end, format_string[start:end]))
+        elif name == 'sign':
+            checks.append("value[%d] not in '+-'" % start)
+            time_body.append("sign = -1 if value[%d] == '-' else 1" % start)
+        elif name in ('year', 'month', 'day', 'doy'):
+            date_fields.append((name, start, end))
+        else:
+            convert = 'float' if name == 'fraction' else 'int'
+            time_body.append('%s = %s(value[%d:%d])' % (name, convert, start, end))
+        names.add(name)
+
+    terms = []
+    date_body = []
+    if date_fields:
+        # Days since 1970-01-01 of the proleptic Gregorian date (H. Hinnant)
+        month = 'month' if 'month' in names else '1'
+        day = 'day' if 'day' in names else '1'
+        date_body += ['%s = int(value[%d:%d])' % _ for _ in date_fields]
+        date_body += [
+            'y = year - (%s <= 2)' % month,
+            'era = y // 400',
+            'yoe = y - era * 400',
+            'doe = yoe * 365 + yoe // 4 - yoe // 100 + (153 * (%s + (-3 if %s > 2 else 9)) + 2) // 5 + %s - 1'
+            % (month, month, day),
+            'days = era * 146097 + doe - 719468' + (' + doy - 1' if 'doy' in names else ''),
+        ]
+        terms.append('days * 86400')
+    for name, seconds in (('hour', 3600), ('minute', 60), ('second', 1), ('fraction', 1)):
+        if name in names:
+            terms.append(name if seconds == 1 else '%s * %d' % (name, seconds))
+    result = ' + '.join(terms) if terms else '0'
+    if 'sign' in names:
+        utc_offset = 'offset_hour * 3600'
+        if 'offset_minute' in names:
+            utc_offset += ' + offset_minute * 60'
+        result = '%s - sign * (%s)' % (result, utc_offset)
+
+    # parse_all computes the days of each distinct date once
+    loop_date_body = []
+    if date_fields:
+        date_slice = 'value[%d:%d]' % (date_fields[0][1], date_fields[-1][2])
+        loop_date_body = ['date = %s' % date_slice, 'days = dates.get(date)', 'if days is None:']
+        loop_date_body += ['    ' + _ for _ in date_body] + ['    dates[date] = days']
+
+    def indent(lines, level):
+        return '\n'.join(' ' * level + _ for _ in lines)
+
+    return PARSER_TEMPLATE % {
+        'checks': ' or '.join(checks),
+        'format_string': format_string.replace("'", ''),
+        'date_body': indent(date_body, 4),
+        'time_body': indent(time_body, 4),
+        'loop_date_body': indent(loop_date_body, 8),
+        'loop_time_body': indent(time_body, 8),
+        'result': result,
+        'typecode': 'd' if 'fraction' in names else 'q',
+    }
+
+
+@lru_cache(maxsize=FORMAT_STRING_CACHE_SIZE)
+def compile_parser(format_string):
+    """Returns (parse, parse_all) functions generated for a format string.
+
+    parse(value) returns the seconds of a value since 1970-01-01T00:00:00
+    UTC, or since midnight for a time without a date; missing month and day
+    fields default to 1. parse_all(values) returns the same for every value
+    as an array of int64 (float64 with fractional seconds). Each function
+    slices the fields out of a value at their fixed offsets, with no regex
+    match and no generic date parsing. Only the length and literal text of
+    a value are checked, not its field ranges; use the regular expression
+    of format_string_visitor() to validate values.
+    """
+    namespace = {'array': array}
+    exec(compile(parser_source(format_string), '<format string %s>' % format_string, 'exec'), namespace)
+    return namespace['parse'], namespace['parse_all']
+
+
+
+def parse_format_string(format_string):
+    """Returns (format string, regex, error) of a format string, for the
+    process pool of batch()"""
+    try:
+        return format_string, format_string_visitor(format_string), None
+    except Exception as e:
+        return format_string, None, str(e)
+
+
+def batch(fin, fout, workers=1, chunk=BATCH_CHUNK):
+    """Writes the regular expression of each format string line of fin to
+    fout, in input order, reading chunk lines at a time. Each distinct format
+    string is parsed once, on a pool of workers processes when workers > 1,
+    and a line whose format string fails to parse is written with an empty
+    regex. Returns the number of lines, the number of distinct format strings
+    and a dict of failed format string -> (error, number of lines).
+    """
+    results = dict()
+    failures = dict()
+    lines = 0
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        while True:
+            stripped_lines = [_.strip() for _ in itertools.islice(fin, chunk)]
+            if not stripped_lines:
+                break
+            format_strings = [_.split(',')[0] for _ in stripped_lines]
+            new = [_ for _ in dict.fromkeys(format_strings) if _ not in results]
+            if pool is not None and len(new) > 1:
+                parsed = pool.imap(parse_format_string, new, max(1, len(new) // (4 * workers)))
+            else:
+                parsed = map(parse_format_string, new)
+            for format_string, regex, error in parsed:
+                results[format_string] = regex
+                if error is not None:
+                    failures[format_string] = (error, 0)
+            for stripped_line, format_string in zip(stripped_lines, format_strings):
+                regex_result = results[format_string]
+                if regex_result is None:
+                    error, count = failures[format_string]
+                    failures[format_string] = (error, count + 1)
+                    regex_result = ''
+                fout.write("%s,%s\n" % (stripped_line, regex_result))
+            lines += len(stripped_lines)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return lines, len(results), failures
+
 
 def main():
     """
@@ -186,12 +404,19 @@ def main():
     Usage:
         format_string_parser.py [-i | --input <input>]
                                 [-o | --output <output>]
+                                [-b | --batch] [--workers=<workers>]
+                                [--chunk=<chunk>]
         format_string_parser.py -h | --help
 
     Options:
         -i --input    Input file to read format strings from
         -o --output   Output results to file; 
                       the filename should have a .csv extension
+        -b --batch    Stream the input in chunks, parse each distinct
+                      format string once and log a summary of counts
+                      and failures instead of each line
+        --workers=<workers>  Worker processes in batch mode [default: 1]
+        --chunk=<chunk>      Lines read at a time in batch mode [default: 10000]
         -h --help     This page
 
     """
@@ -209,6 +434,20 @@ def main():
     else:
         fout = open(output, 'wt')
 
+    if args['--batch']:
+        try:
+            lines, distinct, failures = batch(fin, fout, int(args['--workers']), int(args['--chunk']))
+        finally:
+            if (input):
+                fin.close()
+            if (output):
+                fout.close()
+        for format_string, (error, count) in failures.items():
+            logger.warning("Failed to parse %s (%d lines): %s" % (format_string, count, error))
+        logger.info("Parsed %d lines, %d distinct format strings, %d failed" %
+                    (lines, distinct, sum(count for _, count in failures.values())))
+        return
+
     format_strings = fin.readlines()
     
     if (input):
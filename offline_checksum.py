@@ -13,10 +13,22 @@
 :Created:
     8/23/20
 """
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import collections
+import csv
+import fnmatch
+import heapq
+import itertools
+import json
 import logging
 import hashlib
 import os
 from pathlib import Path
+import random
+import sqlite3
+import sys
+import threading
+import time
 
 import click
 import daiquiri
@@ -28,36 +40,523 @@ daiquiri.setup(level=logging.DEBUG,
                outputs=(daiquiri.output.File(logfile), "stdout",))
 logger = daiquiri.getLogger(__name__)
 
+CHUNK_SIZE = 1024 * 1024
+WINDOW = 10000
+SLOWEST = 10
+COMMIT_INTERVAL = 5.0
+MB = 1000 * 1000
 
-def get_files(data: Path, ext: str = ""):
-    f = list()
+PASS = "pass"
+FAIL = "fail"
+MISSING_FROM_MANIFEST = "missing_from_manifest"
+MISSING_ON_DISK = "missing_on_disk"
+
+DIGESTS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+DIGEST_LENGTHS = {hashlib.new(_).digest_size * 2: _ for _ in DIGESTS}
+
+
+def walk_files(
+        data: str,
+        ext: str = "",
+        include: tuple = (),
+        exclude: tuple = (),
+        symlinks: str = "files"
+):
+    """walk_files
+    Generates (path, stat) for each regular file under data, with extension
+    ext if given, as the tree is walked with os.scandir, so that no file
+    list is built up front. Paths start with data normalized as pathlib
+    would (./data/ walks as data), so they match earlier manifests.
+
+    Each directory is listed in sorted order, with a subdirectory sorting
+    as its name followed by "/", so that paths are generated in the sorted
+    order of the full path strings without sorting the whole tree.
+
+    include and exclude are glob patterns matched against the path relative
+    to data; a file must match an include pattern (when there are any) and
+    no exclude pattern, and directories matching an exclude pattern are not
+    descended into. symlinks is "skip" to ignore symbolic links, "files" to
+    follow links to files but not to directories, or "all" to follow both
+    (each directory is visited once, so link cycles are harmless).
+    """
     if len(ext) > 0:
         ext = "." + ext.lstrip(".")
-    files = data.rglob(f"*{ext}")
-    for file in files:
-        if Path(file).is_file():
-            f.append(file)
-    return f
-
-
-def do_report(report: str, results: dict):
-    if report is None:
-        for file, checksum in results.items():
-            result = f"{file},{checksum}"
-            print(result)
+    data = os.path.normpath(data)
+
+    def listing(directory: str):
+        entries = []
+        try:
+            with os.scandir(directory) as scan:
+                for entry in scan:
+                    relative = os.path.relpath(entry.path, data)
+                    if any(fnmatch.fnmatch(relative, _) for _ in exclude):
+                        continue
+                    if entry.is_symlink() and symlinks == "skip":
+                        continue
+                    follow = symlinks == "all" or not entry.is_symlink()
+                    if entry.is_dir(follow_symlinks=follow):
+                        entries.append((entry.name + "/", entry, relative))
+                    elif entry.is_file():
+                        entries.append((entry.name, entry, relative))
+        except OSError as e:
+            logger.error(f"Failed to list {directory}: {e}")
+        return iter(sorted(entries, key=lambda _: _[0]))
+
+    st = os.stat(data)
+    visited = {(st.st_dev, st.st_ino)}
+    stack = [listing(data)]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+        key, entry, relative = item
+        if key.endswith("/"):
+            st = entry.stat(follow_symlinks=True)
+            if (st.st_dev, st.st_ino) not in visited:
+                visited.add((st.st_dev, st.st_ino))
+                stack.append(listing(entry.path))
+        else:
+            if not entry.name.endswith(ext):
+                continue
+            if include and not any(fnmatch.fnmatch(relative, _) for _ in include):
+                continue
+            yield entry.path, entry.stat()
+
+
+def hash_file(file: str, hash_algorithms: list, chunk_size: int = CHUNK_SIZE) -> list:
+    """hash_file
+    Returns the hex digests of file for each of hash_algorithms, in order,
+    from a single read of the file. The file is read in chunk_size pieces
+    into one reused buffer so that memory use does not depend on its size.
+    """
+    hashes = [_() for _ in hash_algorithms]
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if n == 0:
+                break
+            chunk = view[:n]
+            for h in hashes:
+                h.update(chunk)
+    return [_.hexdigest() for _ in hashes]
+
+
+def timed_hash_file(file: str, hash_algorithms: list, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """timed_hash_file
+    Returns (digests, worker thread name, seconds) of hash_file(file).
+    """
+    start = time.perf_counter()
+    checksums = hash_file(file, hash_algorithms, chunk_size)
+    return checksums, threading.current_thread().name, time.perf_counter() - start
+
+
+class HashMetrics:
+    """HashMetrics
+    Running throughput of a hash_files run: bytes and files hashed, taken
+    from the cache or failed, MB/s of each worker thread and each device
+    (bytes over the seconds spent hashing them), the SLOWEST files by
+    hashing time, and, given the total bytes of the run up front, an ETA
+    from the overall hashing rate.
+    """
+
+    def __init__(self, total_files: int = None, total_bytes: int = None):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.start = time.perf_counter()
+        self.files = {"hashed": 0, "cached": 0, "failed": 0}
+        self.bytes = {"hashed": 0, "cached": 0, "failed": 0}
+        self.workers = dict()
+        self.devices = dict()
+        self.slowest = []
+
+    def record(self, file: str, st: os.stat_result, worker: str, seconds: float):
+        self.files["hashed"] += 1
+        self.bytes["hashed"] += st.st_size
+        for key, totals in ((worker, self.workers), (st.st_dev, self.devices)):
+            size, busy = totals.get(key, (0, 0.0))
+            totals[key] = (size + st.st_size, busy + seconds)
+        heapq.heappush(self.slowest, (seconds, file, st.st_size))
+        if len(self.slowest) > SLOWEST:
+            heapq.heappop(self.slowest)
+
+    def record_cached(self, st: os.stat_result):
+        self.files["cached"] += 1
+        self.bytes["cached"] += st.st_size
+
+    def record_failed(self, st: os.stat_result):
+        self.files["failed"] += 1
+        self.bytes["failed"] += st.st_size
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def rate(self) -> float:
+        """Overall hashing rate in MB/s of wall-clock time"""
+        elapsed = self.elapsed()
+        return self.bytes["hashed"] / MB / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> float:
+        """Seconds left at the overall rate; None without a total or a rate"""
+        rate = self.rate()
+        if self.total_bytes is None or rate == 0:
+            return None
+        remaining = self.total_bytes - sum(self.bytes.values())
+        return max(0.0, remaining / MB / rate)
+
+    def progress(self) -> str:
+        done = sum(self.bytes.values())
+        line = f"{sum(self.files.values())}"
+        if self.total_files is not None:
+            line += f"/{self.total_files}"
+        line += f" files, {done / MB:.1f}"
+        if self.total_bytes is not None:
+            line += f"/{self.total_bytes / MB:.1f} MB"
+            if self.total_bytes > 0:
+                line += f" ({100 * done / self.total_bytes:.1f}%)"
+        else:
+            line += " MB"
+        line += f", {self.rate():.1f} MB/s"
+        eta = self.eta()
+        if eta is not None:
+            line += f", ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}"
+        return line
+
+    def summary(self) -> dict:
+        def throughput(totals: dict) -> dict:
+            return {
+                str(k): {"bytes": b, "seconds": round(s, 3), "mb_per_s": round(b / MB / s, 3) if s > 0 else None}
+                for k, (b, s) in sorted(totals.items())
+            }
+
+        return {
+            "elapsed_seconds": round(self.elapsed(), 3),
+            "total_files": self.total_files,
+            "total_bytes": self.total_bytes,
+            "files": self.files,
+            "bytes": self.bytes,
+            "mb_per_s": round(self.rate(), 3),
+            "workers": throughput(self.workers),
+            "devices": throughput(self.devices),
+            "slowest": [
+                {"file": f, "bytes": b, "seconds": round(s, 3), "mb_per_s": round(b / MB / s, 3) if s > 0 else None}
+                for s, f, b in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+class ChecksumCache:
+    """ChecksumCache
+    Persistent store of digests keyed by file identity: (device, inode,
+    size, mtime_ns). A file whose identity is unchanged since its digests
+    were stored is assumed to be unchanged.
+    """
+
+    SCHEMA = """
+    create table if not exists checksums (
+        dev integer not null,
+        inode integer not null,
+        size integer not null,
+        mtime_ns integer not null,
+        digest text not null,
+        checksum text not null,
+        file text not null,
+        verified real not null,
+        primary key (dev, inode, size, mtime_ns, digest)
+    )
+    """
+
+    def __init__(self, cache: str):
+        self.conn = sqlite3.connect(cache)
+        self.conn.execute(self.SCHEMA)
+        self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    @staticmethod
+    def key(st: os.stat_result) -> tuple:
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, st: os.stat_result, digests: list) -> tuple:
+        """get
+        Returns the cached checksums for digests, in order, and the time the
+        oldest of them was last verified; (None, None) unless all are cached.
+        """
+        sql = (
+            "select digest, checksum, verified from checksums "
+            "where dev=? and inode=? and size=? and mtime_ns=?"
+        )
+        rows = {d: (c, v) for d, c, v in self.conn.execute(sql, self.key(st))}
+        if not all(_ in rows for _ in digests):
+            return None, None
+        return [rows[_][0] for _ in digests], min(rows[_][1] for _ in digests)
+
+    def put(self, st: os.stat_result, file: str, digests: list, checksums: list):
+        sql = "insert or replace into checksums values (?, ?, ?, ?, ?, ?, ?, ?)"
+        now = time.time()
+        self.conn.executemany(
+            sql, [(*self.key(st), d, c, file, now) for d, c in zip(digests, checksums)]
+        )
+
+
+def hash_files(
+        files,
+        digests: list,
+        chunk_size: int = CHUNK_SIZE,
+        workers: int = 1,
+        device_limit: int = 0,
+        verbose: bool = False,
+        cache: ChecksumCache = None,
+        rehash: bool = False,
+        sample: float = 0.0,
+        max_age: float = 0.0,
+        metrics: HashMetrics = None,
+        progress: float = 0.0
+):
+    """hash_files
+    Generates (file, digests) in the order of the (file, stat) pairs
+    generated by files, leaving out files that cannot be read, hashing up
+    to workers files at once on a thread pool (hashlib releases the GIL
+    while digesting large buffers). Files are taken from files as hashing
+    proceeds, and each file's digests are generated as soon as those of the
+    files before it are, keeping at most WINDOW files pending or waiting
+    to be generated, so memory does not depend on the number of files.
+
+    Pending files are started largest first so that a big file is not left
+    running alone at the end of the run, and no more than device_limit
+    files (0 for no limit) are read at once from any one device. A file is
+    only handed to a worker when its device has a free slot, so a busy
+    device never holds up files waiting on another.
+
+    With a cache, files whose identity is unchanged take their digests from
+    the cache instead of being read, unless rehash is set, they fall in a
+    random sample fraction, or their digests were last verified more than
+    max_age days ago (0 for never). A re-verified file whose digests no
+    longer match the cache has changed without its identity changing; this
+    is logged as an error and the cache entry is left as it was. New cache
+    entries are committed at least every COMMIT_INTERVAL seconds, so an
+    interrupted run keeps the digests of the files it finished.
+
+    Throughput is recorded in metrics, if given, and with progress > 0 a
+    progress line is logged at most every progress seconds.
+    """
+    hash_algorithms = [DIGESTS[_] for _ in digests]
+    files = iter(files)
+    exhausted = False
+    order = collections.deque()
+    stats = dict()
+    results = dict()
+    expected = dict()
+    pending = dict()
+    limit = device_limit if device_limit > 0 else workers
+    active = dict()
+
+    def refill():
+        nonlocal exhausted
+        while not exhausted and len(order) < WINDOW:
+            try:
+                file, st = next(files)
+            except StopIteration:
+                exhausted = True
+                break
+            order.append(file)
+            if cache is not None:
+                checksums, verified = cache.get(st, digests)
+                if checksums is not None:
+                    stale = max_age > 0 and time.time() - verified > max_age * 86400
+                    if not (rehash or stale or random.random() < sample):
+                        results[file] = checksums
+                        if metrics is not None:
+                            metrics.record_cached(st)
+                        continue
+                    expected[file] = checksums
+            stats[file] = st
+            heapq.heappush(pending.setdefault(st.st_dev, []), (-st.st_size, file))
+            active.setdefault(st.st_dev, 0)
+
+    running = dict()
+    index = 0
+    reported = time.perf_counter()
+    committed = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker") as executor:
+        refill()
+        while order:
+            while len(running) < workers:
+                ready = [dev for dev in pending if active[dev] < limit]
+                if not ready:
+                    break
+                dev = min(ready, key=lambda _: pending[_][0])
+                size, file = heapq.heappop(pending[dev])
+                if not pending[dev]:
+                    del pending[dev]
+                active[dev] += 1
+                future = executor.submit(timed_hash_file, file, hash_algorithms, chunk_size)
+                running[future] = (dev, file)
+            done = set()
+            if running:
+                done, _ = wait(running, timeout=progress or None, return_when=FIRST_COMPLETED)
+            for future in done:
+                dev, file = running.pop(future)
+                st = stats.pop(file)
+                active[dev] -= 1
+                index += 1
+                try:
+                    results[file], worker, seconds = future.result()
+                except OSError as e:
+                    logger.error(f"Failed to read {file}: {e}")
+                    results[file] = None
+                    if metrics is not None:
+                        metrics.record_failed(st)
+                    continue
+                if metrics is not None:
+                    metrics.record(file, st, worker, seconds)
+                if file in expected and expected.pop(file) != results[file]:
+                    # Keep the cached digests so that later audits flag the file too
+                    msg = f"Cached checksum mismatch for unchanged file - {file}"
+                    logger.error(msg)
+                elif cache is not None:
+                    cache.put(st, file, digests, results[file])
+                if verbose:
+                    print(f"{index}: {file} - {' '.join(results[file])}")
+            if progress > 0 and time.perf_counter() - reported >= progress:
+                reported = time.perf_counter()
+                logger.info(metrics.progress())
+            if cache is not None and time.perf_counter() - committed >= COMMIT_INTERVAL:
+                committed = time.perf_counter()
+                cache.commit()
+            while order and order[0] in results:
+                file = order.popleft()
+                checksums = results.pop(file)
+                if checksums is not None:
+                    yield file, checksums
+            refill()
+
+
+def read_manifest(m) -> tuple:
+    """read_manifest
+    Returns the digest names of the manifest columns (None for a column
+    that is not a digest) and a generator of (file, digests) rows read from
+    the open CSV file m. A manifest may start with a "file,<digest>,..."
+    header row; without one, each column's digest is recognized by the hex
+    length of the first row. Rows shorter than the header are padded with
+    empty checksums.
+    """
+    reader = csv.reader(m)
+    first = next(reader, None)
+    if first is None:
+        return [], iter(())
+    if first[0] == "file":
+        digests = [_ if _ in DIGESTS else None for _ in first[1:]]
+        rows = reader
     else:
-        with open(report, "w") as r:
-            for file, checksum in results.items():
-                result = f"{file},{checksum}\n"
-                r.write(result)
+        digests = [DIGEST_LENGTHS.get(len(_.strip())) for _ in first[1:]]
+        rows = itertools.chain([first], reader)
+    width = len(digests) + 1
+    return digests, (
+        (r[0], [_.strip() for _ in r[1:width]] + [""] * (width - len(r))) for r in rows if len(r) > 0
+    )
+
+
+def reconcile(results, columns: list, digests: list, rows, sorted_manifest: bool = False):
+    """reconcile
+    Generates (file, checksums, status) in file order for every file on
+    disk and every file in the manifest rows, where status is one of PASS,
+    FAIL (a digest shared by the run and the manifest differs),
+    MISSING_FROM_MANIFEST or MISSING_ON_DISK. results generates (file,
+    checksums) in sorted file order, as hash_files does for walk_files.
+
+    The manifest rows are merge-joined against the results. By default
+    they are first read into memory and sorted by file (the last row of a
+    file listed more than once wins). With sorted_manifest, they must
+    already be in sorted file order (as written by do_report) and only one
+    manifest row is held in memory at a time.
+    """
+    compared = [(columns.index(_), i) for i, _ in enumerate(digests) if _ in columns]
+    if len(compared) == 0:
+        msg = f"Manifest has none of the selected digests: {', '.join(columns)}"
+        raise ValueError(msg)
+
+    def compare(checksums: list, m_checksums: list) -> str:
+        if all(c < len(checksums) and m < len(m_checksums) and checksums[c] == m_checksums[m]
+               for c, m in compared):
+            return PASS
+        return FAIL
+
+    def missing_on_disk(m_file: str, m_checksums: list) -> tuple:
+        checksums = [m_checksums[digests.index(_)] if _ in digests else "" for _ in columns]
+        return m_file, checksums, MISSING_ON_DISK
+
+    if not sorted_manifest:
+        rows = sorted(dict(rows).items())
+
+    disk = iter(results)
+    file, checksums = next(disk, (None, None))
+    previous = None
+    for m_file, m_checksums in rows:
+        if previous is not None and m_file <= previous:
+            msg = f"Manifest is not sorted by file at '{m_file}'"
+            raise ValueError(msg)
+        previous = m_file
+        while file is not None and file < m_file:
+            yield file, checksums, MISSING_FROM_MANIFEST
+            file, checksums = next(disk, (None, None))
+        if file == m_file:
+            yield file, checksums, compare(checksums, m_checksums)
+            file, checksums = next(disk, (None, None))
+        else:
+            yield missing_on_disk(m_file, m_checksums)
+    while file is not None:
+        yield file, checksums, MISSING_FROM_MANIFEST
+        file, checksums = next(disk, (None, None))
+
+
+def do_report(report: str, columns: list, rows):
+    """do_report
+    Writes a CSV header of "file" and columns, then one line per row of
+    fields, quoting fields (such as paths) that contain commas or quotes.
+    """
+    r = sys.stdout if report is None else open(report, "w", newline="")
+    try:
+        writer = csv.writer(r, lineterminator="\n")
+        writer.writerow(["file"] + columns)
+        writer.writerows(rows)
+    finally:
+        if report is not None:
+            r.close()
 
 
 report_help = "Report file (defaults to stdout only)"
 manifest_help = "Import a manifest of prior checksums for comparison"
+sorted_manifest_help = "Manifest is in sorted file order; merge-join it instead of indexing it in memory"
 verbose_help = "Print progress to stdout"
-md5_help = "Perform MD5 checksum analysis only"
-sha1_help = "Perform SHA1 checksum analysis only"
+md5_help = "Perform MD5 checksum analysis (same as -d md5)"
+sha1_help = "Perform SHA1 checksum analysis (same as -d sha1)"
+digest_help = "Digest(s) to compute in one pass, in report column order e.g. -d sha256 -d md5"
 ext_help = "Data file extension (default is none)"
+include_help = "Only hash files whose path relative to DATA matches glob(s) e.g. -i '*.tar' -i 'raw/*'"
+exclude_help = "Skip files and directories whose path relative to DATA matches glob(s)"
+symlinks_help = "Symbolic links: skip them, follow links to files only (default), or follow all"
+chunk_size_help = f"Read buffer size in bytes (default {CHUNK_SIZE})"
+workers_help = "Number of files hashed concurrently (default 1)"
+device_limit_help = "Maximum number of files read concurrently from one device (default 0, no limit)"
+cache_help = "Checksum cache file; files unchanged since they were last hashed are not read again"
+rehash_help = "Hash every file and refresh the cache"
+sample_help = "Fraction of cached files to re-verify at random (default 0.0)"
+max_age_help = "Re-verify cached files last verified more than this many days ago (default 0, never)"
+progress_help = "Log a progress line with MB/s and ETA every this many seconds (default 0, off); lists DATA up front, holding every path in memory"
+metrics_help = "Write a JSON summary of throughput per worker and device and the slowest files to this file"
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
 
@@ -65,22 +564,51 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 @click.argument("data",  nargs=1, required=True)
 @click.option("-r", "--report", default=None, help=report_help)
 @click.option("-m", "--manifest", default=None, help=manifest_help)
+@click.option("--sorted_manifest", is_flag=True, default=False, help=sorted_manifest_help)
 @click.option("-v", "--verbose", is_flag=True, default=False, help=verbose_help)
 @click.option("--md5", is_flag=True, help=md5_help)
 @click.option("--sha1", is_flag=True, help=sha1_help)
+@click.option("-d", "--digest", multiple=True, type=click.Choice(list(DIGESTS)), help=digest_help)
 @click.option("--ext", default="", help=ext_help)
+@click.option("-i", "--include", multiple=True, help=include_help)
+@click.option("-x", "--exclude", multiple=True, help=exclude_help)
+@click.option("--symlinks", default="files", type=click.Choice(["skip", "files", "all"]), help=symlinks_help)
+@click.option("--chunk_size", default=CHUNK_SIZE, help=chunk_size_help)
+@click.option("-w", "--workers", default=1, help=workers_help)
+@click.option("--device_limit", default=0, help=device_limit_help)
+@click.option("-c", "--cache", default=None, help=cache_help)
+@click.option("--rehash", is_flag=True, default=False, help=rehash_help)
+@click.option("--sample", default=0.0, help=sample_help)
+@click.option("--max_age", default=0.0, help=max_age_help)
+@click.option("--progress", default=0.0, help=progress_help)
+@click.option("--metrics", default=None, help=metrics_help)
 def main(
         data: str,
         report: str,
         manifest: str,
+        sorted_manifest: bool,
         verbose: bool,
         md5: bool,
         sha1: bool,
-        ext: str
+        digest: tuple,
+        ext: str,
+        include: tuple,
+        exclude: tuple,
+        symlinks: str,
+        chunk_size: int,
+        workers: int,
+        device_limit: int,
+        cache: str,
+        rehash: bool,
+        sample: float,
+        max_age: float,
+        progress: float,
+        metrics: str
 ):
     """
-        Perform checksum analysis of offline data files. By default, both
-        MD5 and SHA1 checksum analysis are done per file.
+        Perform checksum analysis of offline data files. Every selected
+        digest is computed from a single read of each file. By default,
+        both MD5 and SHA1 checksum analysis are done per file.
 
         \b
             DATA: Data directory where checksum analysis begins.
@@ -102,45 +630,73 @@ def main(
             msg = f"Manifest '{manifest}' was not found or is not a file"
             raise FileNotFoundError(msg)
 
-    if not (md5 or sha1):
-        msg = "Either an MD5 or SHA1 hash algorithm must be selected"
+    if chunk_size < 1:
+        msg = "Chunk size must be a positive number of bytes"
         raise ValueError(msg)
-    elif md5 and sha1:
-        msg = "Only one of MD5 or SHA1 hash algorithms should be selected"
+    if workers < 1:
+        msg = "At least one worker is required"
+        raise ValueError(msg)
+    if not 0.0 <= sample <= 1.0:
+        msg = "Sample must be a fraction between 0 and 1"
+        raise ValueError(msg)
+    if progress < 0:
+        msg = "Progress interval must not be negative"
         raise ValueError(msg)
-    if md5:
-        hash_algorithm = hashlib.md5
-    else:
-        hash_algorithm = hashlib.sha1
 
-    files = get_files(d, ext)
-    results = dict()
-    for index, file in enumerate(files, start=1):
-        file = str(file)
-        checksum = hash_algorithm(open(file, "rb").read()).hexdigest()
-        results[file] = checksum if (manifest is None) else checksum + ","
-        if verbose:
-            print(f"{index}: {str(file)} - {checksum}")
-
-    if manifest is None:
-        do_report(report, results)
-    else:
-        with open(manifest, "r") as m:
-            lines = m.readlines()
-            for line in lines:
-                m_file, m_checksum = line.split(",")
-                if m_file in results:
-                    checksum = m_checksum.strip()
-                    if checksum + "," != results[m_file]:
-                        results[m_file] = results[m_file] + "fail"
-                        msg = f"Checksum mismatch - {results[m_file]}"
+    columns = list(dict.fromkeys(digest))
+    if md5 and "md5" not in columns:
+        columns.append("md5")
+    if sha1 and "sha1" not in columns:
+        columns.append("sha1")
+    if len(columns) == 0:
+        columns = ["md5", "sha1"]
+
+    files = walk_files(data, ext, include, exclude, symlinks)
+    hash_metrics = None
+    if progress > 0:
+        # The ETA needs the total size of the run, so list the files first;
+        # unlike the rest of the run, this holds every file's path and stat
+        files = list(files)
+        hash_metrics = HashMetrics(len(files), sum(st.st_size for _, st in files))
+    elif metrics is not None:
+        hash_metrics = HashMetrics()
+
+    checksum_cache = None if cache is None else ChecksumCache(cache)
+    try:
+        # Report rows are written as the digests of each file are generated
+        results = hash_files(
+            files, columns, chunk_size, workers, device_limit, verbose, checksum_cache, rehash, sample, max_age,
+            hash_metrics, progress
+        )
+        if manifest is None:
+            do_report(report, columns, ([file] + checksums for file, checksums in results))
+        else:
+            counts = dict.fromkeys((PASS, FAIL, MISSING_FROM_MANIFEST, MISSING_ON_DISK), 0)
+
+            def rows():
+                for file, checksums, status in reconcile(results, columns, m_digests, m_rows, sorted_manifest):
+                    counts[status] += 1
+                    if status == FAIL:
+                        msg = f"Checksum mismatch - {file},{','.join(checksums)}"
+                        logger.warning(msg)
+                    elif status == MISSING_ON_DISK:
+                        msg = f"Manifest `{file}` not found in data directory"
                         logger.warning(msg)
-                    else:
-                        results[m_file] = results[m_file] + "pass"
-                else:
-                    msg = f"Manifest `{m_file}` not found in data directory"
-                    logger.warning(msg)
-        do_report(report, results)
+                    yield [file] + checksums + [status]
+
+            with open(manifest, "r", newline="") as m:
+                m_digests, m_rows = read_manifest(m)
+                do_report(report, columns + ["status"], rows())
+            logger.info(", ".join(f"{k}: {v}" for k, v in counts.items()))
+    finally:
+        if checksum_cache is not None:
+            checksum_cache.close()
+
+    if progress > 0:
+        logger.info(hash_metrics.progress())
+    if metrics is not None:
+        with open(metrics, "w") as f:
+            json.dump(hash_metrics.summary(), f, indent=2)
 
     return 0
 
@@ -11,7 +11,9 @@
 :Created:
     2/22/19
 """
+from multiprocessing import Pool
 from pathlib import Path
+import sys
 
 import click
 import daiquiri
@@ -21,33 +23,96 @@ from lxml import etree
 logger = daiquiri.getLogger('project: ' + __name__)
 
 
-def flatten(element):
-    t = ''
-    if hasattr(element, 'text') and element.text is not None:
-        t = element.text.strip().replace('\t', '').replace('\n', '').replace('\r', '')
-    if hasattr(element, '__iter__'):
-        for e in element:
-            t += flatten(e)
-    return t
+def flatten(element) -> str:
+    """flatten
+    Returns the text content of element and its descendants, in document
+    order, with each run of whitespace collapsed to a single space.
+    """
+    return ' '.join(''.join(element.itertext()).split())
+
+
+def get_funding(eml_f: str) -> tuple:
+    """get_funding
+    Returns (eml_f, package id, flattened funding text, error) for an EML
+    file; funding is None when there is none and error is None on success.
+
+    The document is parsed incrementally: elements outside of a project are
+    discarded as soon as they end, and parsing stops at the first
+    project/funding.
+    """
+    pid = None
+    in_project = 0
+    try:
+        for event, element in etree.iterparse(eml_f, events=('start', 'end')):
+            if event == 'start':
+                if pid is None:
+                    pid = element.get('packageId')
+                if element.tag == 'project':
+                    in_project += 1
+                continue
+            if element.tag == 'funding':
+                parent = element.getparent()
+                if parent is not None and parent.tag == 'project':
+                    return eml_f, pid, flatten(element), None
+            if element.tag == 'project':
+                in_project -= 1
+            if in_project == 0:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        return eml_f, pid, None, None
+    except Exception as e:
+        return eml_f, None, None, str(e)
+
+
+workers_help = "Number of worker processes (default 1, no pool)"
+chunksize_help = "Number of EML files handed to a worker at a time (default 64)"
+unordered_help = "Write rows as workers finish instead of in directory order"
+output_help = "TSV output file (defaults to stdout)"
 
 
 @click.command()
 @click.argument('e_dir')
-def main(e_dir: str):
+@click.option('-w', '--workers', default=1, help=workers_help)
+@click.option('-c', '--chunksize', default=64, help=chunksize_help)
+@click.option('-u', '--unordered', is_flag=True, help=unordered_help)
+@click.option('-o', '--output', default=None, help=output_help)
+def main(e_dir: str, workers: int, chunksize: int, unordered: bool, output: str):
 
     if not Path(e_dir).is_dir():
         logger.error(f'Directory "{e_dir}" does not exist')
         exit(1)
 
-    for eml_f in Path(e_dir).iterdir():
-        with open(str(eml_f), 'r') as f:
-            eml = f.read()
-            root = etree.fromstring(eml.encode("utf-8"))
-            funding = root.find('.//project/funding')
-            if funding is not None:
-                pid = root.get('packageId')
-                t = flatten(funding)
-                print(f'{pid}\t{t}')
+    eml_fs = [str(_) for _ in Path(e_dir).iterdir()]
+
+    pool = None
+    if workers > 1:
+        pool = Pool(workers)
+        if unordered:
+            results = pool.imap_unordered(get_funding, eml_fs, chunksize)
+        else:
+            results = pool.imap(get_funding, eml_fs, chunksize)
+    else:
+        results = map(get_funding, eml_fs)
+
+    failed = 0
+    f = sys.stdout if output is None else open(output, 'w', encoding='utf-8')
+    try:
+        for eml_f, pid, t, error in results:
+            if error is not None:
+                failed += 1
+                logger.error(f'Failed to parse "{eml_f}": {error}')
+            elif t is not None:
+                f.write(f'{pid}\t{t}\n')
+    finally:
+        if output is not None:
+            f.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if failed > 0:
+        logger.warning(f'{failed} of {len(eml_fs)} EML files could not be parsed')
 
     return 0
 
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: unit_dictionary
+
+:Synopsis:
+    Indexed EML unit dictionary. eml-unitDictionary.xml is parsed once into
+    a JSON index, saved beside it, of every unit by id with lookup tables by
+    name, case-folded name and abbreviation and the final replacement of
+    each deprecated unit. Later loads read the index instead of the XML,
+    and rebuild it only when the XML changes.
+    usage: unit_dictionary.py build
+           unit_dictionary.py lookup meter cm/year centimeterPerYear
+
+:Created:
+    10/18/26
+"""
+from functools import lru_cache
+import json
+import os
+from pathlib import Path
+
+import click
+import daiquiri
+from lxml import etree
+
+
+logger = daiquiri.getLogger(__name__)
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+UNIT_DICTIONARY = os.path.join(cwd, "eml-unitDictionary.xml")
+INDEX_VERSION = 1
+
+
+def default_index(xml: str) -> str:
+    return str(Path(xml).with_suffix(".index.json"))
+
+
+def localname(element) -> str:
+    return element.tag.rpartition("}")[2]
+
+
+def parse_units(xml: str) -> dict:
+    """parse_units
+    Returns a dict of unit id -> unit attributes (and description) of the
+    unit elements of an EML unit dictionary. The first definition of an id
+    defined more than once is kept.
+    """
+    units = dict()
+    for element in etree.parse(xml).getroot():
+        if not isinstance(element.tag, str) or localname(element) != "unit":
+            continue
+        unit = {k: v for k, v in element.attrib.items() if v != ""}
+        for child in element:
+            if isinstance(child.tag, str) and localname(child) == "description" and child.text:
+                unit["description"] = " ".join(child.text.split())
+        if unit["id"] in units:
+            logger.warning(f"Unit '{unit['id']}' is defined more than once; keeping the first definition")
+            continue
+        units[unit["id"]] = unit
+    return units
+
+
+def resolve(units: dict, unit_id: str) -> str:
+    """resolve
+    Returns the unit that unit_id is finally deprecated in favor of,
+    following deprecatedInFavorOf through the units, or unit_id itself if it
+    is not deprecated. A chain stops at a replacement that is not a unit or
+    that has already been visited (a unit deprecated in favor of itself).
+    """
+    chain = [unit_id]
+    while True:
+        replacement = units[chain[-1]].get("deprecatedInFavorOf")
+        if replacement is None or replacement in chain:
+            break
+        if replacement not in units:
+            logger.warning(f"Unit '{chain[-1]}' is deprecated in favor of unknown unit '{replacement}'")
+            break
+        chain.append(replacement)
+    return chain[-1]
+
+
+def build_index(xml: str) -> dict:
+    units = parse_units(xml)
+    names = dict()
+    folded = dict()
+    abbreviations = dict()
+    for unit_id, unit in units.items():
+        names.setdefault(unit["name"], unit_id)
+        folded.setdefault(unit["name"].lower(), unit_id)
+        if "abbreviation" in unit:
+            abbreviations.setdefault(unit["abbreviation"], []).append(unit_id)
+    replacements = dict()
+    for unit_id in units:
+        replacement = resolve(units, unit_id)
+        if replacement != unit_id:
+            replacements[unit_id] = replacement
+    st = os.stat(xml)
+    return {
+        "version": INDEX_VERSION,
+        "source": {"size": st.st_size, "mtime_ns": st.st_mtime_ns},
+        "units": units,
+        "names": names,
+        "folded": folded,
+        "abbreviations": abbreviations,
+        "replacements": replacements,
+    }
+
+
+class UnitDictionary:
+    """UnitDictionary
+    Constant time lookups of units by id, name, case-folded name and
+    abbreviation, and of the final replacement of deprecated units.
+    """
+
+    def __init__(self, index: dict):
+        self.units = index["units"]
+        self.names = index["names"]
+        self.folded = index["folded"]
+        self.abbreviations = index["abbreviations"]
+        self.replacements = index["replacements"]
+
+    def __contains__(self, unit_id: str) -> bool:
+        return unit_id in self.units
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def get(self, unit_id: str) -> dict:
+        return self.units.get(unit_id)
+
+    def by_name(self, name: str) -> dict:
+        unit_id = self.names.get(name)
+        return None if unit_id is None else self.units[unit_id]
+
+    def by_folded_name(self, name: str) -> dict:
+        unit_id = self.folded.get(name.lower())
+        return None if unit_id is None else self.units[unit_id]
+
+    def by_abbreviation(self, abbreviation: str) -> list:
+        return [self.units[_] for _ in self.abbreviations.get(abbreviation, ())]
+
+    def find(self, unit: str) -> list:
+        """find
+        Returns the units a unit string refers to: the unit with that id or
+        name, else the units with that abbreviation, else the unit with
+        that name ignoring case.
+        """
+        found = self.get(unit) or self.by_name(unit)
+        if found is not None:
+            return [found]
+        found = self.by_abbreviation(unit)
+        if found:
+            return found
+        found = self.by_folded_name(unit)
+        return [] if found is None else [found]
+
+    def is_deprecated(self, unit_id: str) -> bool:
+        return unit_id in self.replacements
+
+    def replacement(self, unit_id: str) -> str:
+        """replacement
+        Returns the standard unit a deprecated unit_id is finally replaced
+        by, or None if unit_id is not deprecated.
+        """
+        return self.replacements.get(unit_id)
+
+    def standard_units(self) -> list:
+        return sorted((_ for _ in self.units if _ not in self.replacements), key=str.lower)
+
+    def deprecated_units(self) -> list:
+        return sorted(self.replacements, key=str.lower)
+
+
+def read_index(xml: str, index: str) -> dict:
+    """read_index
+    Returns the saved index of xml, or None if there is none or it is out
+    of date with xml.
+    """
+    try:
+        with open(index, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    st = os.stat(xml)
+    source = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if saved.get("version") != INDEX_VERSION or saved.get("source") != source:
+        return None
+    return saved
+
+
+def write_index(index: str, built: dict):
+    tmp = index + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(built, f, separators=(",", ":"))
+    os.replace(tmp, index)
+
+
+@lru_cache(maxsize=None)
+def load(xml: str = UNIT_DICTIONARY, index: str = None) -> UnitDictionary:
+    """load
+    Returns the UnitDictionary of xml from its saved index (by default
+    beside xml), building and saving the index first if it is missing or
+    out of date. The dictionary is loaded once per process.
+    """
+    index = default_index(xml) if index is None else index
+    saved = read_index(xml, index)
+    if saved is None:
+        saved = build_index(xml)
+        try:
+            write_index(index, saved)
+        except OSError as e:
+            logger.warning(f"Failed to save unit dictionary index '{index}': {e}")
+    return UnitDictionary(saved)
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def main():
+    """
+        Indexed EML unit dictionary.
+    """
+    pass
+
+
+@main.command()
+@click.option("-x", "--xml", default=UNIT_DICTIONARY, help="EML unit dictionary (default eml-unitDictionary.xml)")
+@click.option("-i", "--index", default=None, help="Index file (default beside the unit dictionary)")
+def build(xml: str, index: str):
+    """
+        Parse the unit dictionary and save its index.
+    """
+    if not Path(xml).is_file():
+        msg = f'Unit dictionary "{xml}" does not exist'
+        raise click.ClickException(msg)
+    index = default_index(xml) if index is None else index
+    built = build_index(xml)
+    write_index(index, built)
+    print(f"Indexed {len(built['units'])} units ({len(built['replacements'])} deprecated) to {index}")
+
+
+@main.command()
+@click.argument("units", nargs=-1, required=True)
+@click.option("-x", "--xml", default=UNIT_DICTIONARY, help="EML unit dictionary (default eml-unitDictionary.xml)")
+@click.option("-i", "--index", default=None, help="Index file (default beside the unit dictionary)")
+def lookup(units: tuple, xml: str, index: str):
+    """
+        Print the id, name, abbreviation and status of each of UNITS, given
+        by id, name or abbreviation.
+    """
+    dictionary = load(xml, index)
+    for u in units:
+        found = dictionary.find(u)
+        if not found:
+            print(f"{u}\tunknown")
+        for unit in found:
+            replacement = dictionary.replacement(unit["id"])
+            status = "standard" if replacement is None else f"deprecated in favor of {replacement}"
+            print(f"{u}\t{unit['id']}\t{unit.get('abbreviation', '')}\t{status}")
+
+
+if __name__ == "__main__":
+    main()
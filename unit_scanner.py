@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""":Mod: unit_scanner
+
+:Synopsis:
+    Check the standardUnit and customUnit of every attribute of the EML
+    documents of a local directory against the EML unit dictionary, and
+    report unknown units, deprecated units with their replacements and the
+    counts of each status per scope. Documents are parsed by streaming on a
+    pool of worker processes; units are checked against the indexed unit
+    dictionary in the main process.
+    usage: unit_scanner.py -w 8 -o /tmp/units.csv -s /tmp/units.json /tmp/eml
+
+    A standardUnit is "ok" if it is a unit of the dictionary, "deprecated"
+    if the dictionary deprecates it, and "unknown" otherwise. A customUnit
+    is "custom" if the document defines it in a unitList, "standard" if it
+    is a standard unit of the dictionary (and should be a standardUnit),
+    "deprecated" if it is a deprecated one, and "unknown" otherwise.
+
+:Created:
+    10/18/26
+"""
+from collections import Counter
+import csv
+import json
+from pathlib import Path
+import sys
+
+import click
+import daiquiri
+
+from eml_extract import extract_files
+import unit_dictionary
+
+
+logger = daiquiri.getLogger(__name__)
+
+OK = "ok"
+DEPRECATED = "deprecated"
+UNKNOWN = "unknown"
+CUSTOM = "custom"
+STANDARD = "standard"
+STATUSES = (OK, DEPRECATED, UNKNOWN, CUSTOM, STANDARD)
+PROBLEMS = (DEPRECATED, UNKNOWN, STANDARD)
+EML_SUFFIXES = (".xml", ".eml")
+
+
+def check_unit(dictionary: unit_dictionary.UnitDictionary, unit: str, unit_type: str, defined: set) -> tuple:
+    """check_unit
+    Returns (status, replacement) of a unit of unit_type "standardUnit" or
+    "customUnit", where defined is the set of custom unit ids of its
+    document. replacement is the standard unit that a deprecated unit is
+    replaced by, or for an unknown unit a dictionary unit with that
+    abbreviation or name ignoring case (None if there is none).
+    """
+    if unit in dictionary:
+        replacement = dictionary.replacement(unit)
+        if replacement is not None:
+            return DEPRECATED, replacement
+        return (OK if unit_type == "standardUnit" else STANDARD), None
+    if unit_type == "customUnit" and unit in defined:
+        return CUSTOM, None
+    found = dictionary.find(unit)
+    return UNKNOWN, (found[0]["id"] if len(found) == 1 else None)
+
+
+def scope_of(pid: str) -> str:
+    return None if pid is None else pid.split(".", 1)[0]
+
+
+def scan(paths: list, dictionary: unit_dictionary.UnitDictionary, workers: int = 1):
+    """scan
+    Generates (package id, entity name, attribute name, unit, unit type,
+    status, replacement) for every unit of the EML files of paths, in path
+    order, logging documents that fail to parse.
+    """
+    for path, record, error in extract_files(paths, ["units", "unit_definitions"], workers):
+        if error is not None:
+            logger.error(f'Failed to parse "{path}": {error}')
+            continue
+        pid = record["package_id"]
+        defined = set(record["unit_definitions"])
+        for entity_name, attribute_name, unit, unit_type in record["units"]:
+            unit = (unit or "").strip()
+            status, replacement = check_unit(dictionary, unit, unit_type, defined)
+            yield pid, entity_name, attribute_name, unit, unit_type, status, replacement
+
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument("e_dir")
+@click.option("-w", "--workers", default=1, help="Number of worker processes (default 1, no pool)")
+@click.option("-a", "--all", "all_units", is_flag=True, help="Report every unit, not only deprecated and unknown ones")
+@click.option("-o", "--output", default=None, help="CSV report file (defaults to stdout)")
+@click.option("-s", "--summary", default=None, help="JSON file of per-scope counts and unknown and deprecated units")
+@click.option("-x", "--xml", default=unit_dictionary.UNIT_DICTIONARY,
+              help="EML unit dictionary (default eml-unitDictionary.xml)")
+def main(e_dir: str, workers: int, all_units: bool, output: str, summary: str, xml: str):
+    """
+        Check the units of the EML files of E_DIR against the EML unit
+        dictionary and report deprecated and unknown units as CSV.
+    """
+    if not Path(e_dir).is_dir():
+        msg = f'Directory "{e_dir}" does not exist'
+        raise click.ClickException(msg)
+
+    dictionary = unit_dictionary.load(xml)
+    paths = sorted(str(_) for _ in Path(e_dir).iterdir() if _.suffix in EML_SUFFIXES)
+
+    scopes = dict()
+    unknown = Counter()
+    deprecated = Counter()
+    replacements = dict()
+    f = sys.stdout if output is None else open(output, "w", newline="")
+    try:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["package_id", "entity", "attribute", "unit", "unit_type", "status", "replacement"])
+        for row in scan(paths, dictionary, workers):
+            pid, _, _, unit, _, status, replacement = row
+            scopes.setdefault(scope_of(pid), Counter())[status] += 1
+            if status == UNKNOWN:
+                unknown[unit] += 1
+            elif status == DEPRECATED:
+                deprecated[unit] += 1
+                replacements[unit] = replacement
+            if all_units or status in PROBLEMS:
+                writer.writerow(row)
+    finally:
+        if output is not None:
+            f.close()
+
+    totals = Counter()
+    for counts in scopes.values():
+        totals.update(counts)
+    logger.info(", ".join(f"{_}: {totals[_]}" for _ in STATUSES))
+
+    if summary is not None:
+        report = {
+            "documents": len(paths),
+            "totals": {_: totals[_] for _ in STATUSES},
+            "scopes": {str(s): {_: c[_] for _ in STATUSES} for s, c in sorted(scopes.items(), key=lambda _: str(_[0]))},
+            "unknown": dict(unknown.most_common()),
+            "deprecated": {u: {"count": n, "replacement": replacements[u]} for u, n in deprecated.most_common()},
+        }
+        with open(summary, "w") as s:
+            json.dump(report, s, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()